@@ -1,35 +1,150 @@
 from dataclasses import dataclass
 import json
-from typing import Optional
+from multiprocessing import Pool
+from typing import Optional, Union
 import numpy as np
 from sklearn.cluster import AgglomerativeClustering
+from scipy.cluster.hierarchy import linkage as linkage_matrix_from_triu
+import scipy.sparse
+from scipy.sparse.csgraph import minimum_spanning_tree
 from Bio.SeqFeature import SeqFeature
 from Bio.SeqRecord import SeqRecord
 from Bio.Phylo.PhyloXML import Clade, Phylogeny
 from .treeFromClusters import feature_to_leave, new_phylogeny
 from .featureUtils import feature_to_seq, label_to_feature
 from .assertions import assert_equal
+from .matrix_utils import DeduplicatedMatrix, matrix_row, matrix_size, matrix_to_triu, triu_lookup
+from .kmer_features import seqs_kmer_distance_matrix, seqs_kmer_distance_triu
+
+@dataclass
+class CladeChildren:
+    offsets: np.ndarray
+    indices: np.ndarray
+
+    @staticmethod
+    def from_lists(children: list[list[int]]) -> 'CladeChildren':
+        offsets = np.zeros(len(children) + 1, dtype=np.int32)
+        np.cumsum([len(subclades) for subclades in children], out=offsets[1:])
+        return CladeChildren(
+            offsets=offsets,
+            indices=np.fromiter(
+                (subclade for subclades in children for subclade in subclades),
+                dtype=np.int32, count=int(offsets[-1])
+            )
+        )
+
+    def to_lists(self) -> list[list[int]]:
+        return [
+            self.indices[start:end].tolist()
+            for start, end in zip(self.offsets[:-1].tolist(), self.offsets[1:].tolist())
+        ]
+
+    def __len__(self):
+        return len(self.offsets) - 1
 
 class SimplePhylogeny:
     num_leaves: int
-    children: list[list[int]]
+    clade_children: CladeChildren
     root_clade_index: int
     num_clades: int
+    clade_parents: np.ndarray
+    clade_heights: np.ndarray
+    clade_sizes: np.ndarray
+    clade_num_leaves: np.ndarray
+    clade_leaf_starts: np.ndarray
+    clade_post_positions: np.ndarray
+    leaves_in_order: np.ndarray
+    clades_post_order: np.ndarray
     
     def __init__(
         self,
         num_leaves: int,
-        children: list[list[int]]
+        children: Union[list[list[int]], CladeChildren]
     ):
         self.num_leaves = num_leaves
         self.children = children
-        self.num_clades = num_leaves + len(children)
+
+    @property
+    def children(self) -> list[list[int]]:
+        return self.clade_children.to_lists()
+
+    @children.setter
+    def children(self, children: Union[list[list[int]], CladeChildren]):
+        self.clade_children = (
+            children if isinstance(children, CladeChildren)
+            else CladeChildren.from_lists(children)
+        )
+        self.num_clades = self.num_leaves + len(self.clade_children)
         self.root_clade_index = self.num_clades - 1
+        self.index_clades()
+
+    def index_clades(self):
+        num_clades = self.num_clades
+        offsets = self.clade_children.offsets
+        self.clade_parents = np.full(num_clades, -1, dtype=np.int32)
+        self.clade_parents[self.clade_children.indices] = np.repeat(
+            np.arange(self.num_leaves, num_clades, dtype=np.int32), np.diff(offsets)
+        )
+        offsets_list = offsets.tolist()
+        indices_list = self.clade_children.indices.tolist()
+        parents = self.clade_parents.tolist()
+
+        pre_order = []
+        depths = [0] * num_clades
+        clades_to_visit = [self.root_clade_index] if num_clades > 0 else []
+        while len(clades_to_visit) > 0:
+            clade_index = clades_to_visit.pop()
+            pre_order.append(clade_index)
+            if parents[clade_index] >= 0:
+                depths[clade_index] = depths[parents[clade_index]] + 1
+            if clade_index >= self.num_leaves:
+                internal_clade_index = clade_index - self.num_leaves
+                clades_to_visit.extend(reversed(
+                    indices_list[offsets_list[internal_clade_index]:offsets_list[internal_clade_index + 1]]
+                ))
+
+        heights = [0] * num_clades
+        sizes = [1] * num_clades
+        leaf_counts = [1] * self.num_leaves + [0] * (num_clades - self.num_leaves)
+        for clade_index in reversed(pre_order):
+            parent_index = parents[clade_index]
+            if parent_index >= 0:
+                if heights[clade_index] >= heights[parent_index]:
+                    heights[parent_index] = heights[clade_index] + 1
+                sizes[parent_index] += sizes[clade_index]
+                leaf_counts[parent_index] += leaf_counts[clade_index]
+
+        pre_order = np.array(pre_order, dtype=np.int32)
+        self.clade_heights = np.array(heights, dtype=np.int32)
+        self.clade_sizes = np.array(sizes, dtype=np.int32)
+        self.clade_num_leaves = np.array(leaf_counts, dtype=np.int32)
+        pre_order_leaves = pre_order < self.num_leaves
+        self.leaves_in_order = pre_order[pre_order_leaves]
+        self.clade_leaf_starts = np.zeros(num_clades, dtype=np.int32)
+        self.clade_leaf_starts[pre_order] = np.cumsum(pre_order_leaves) - pre_order_leaves
+        self.clade_post_positions = np.zeros(num_clades, dtype=np.int32)
+        self.clade_post_positions[pre_order] = (
+            np.arange(len(pre_order)) - np.array(depths, dtype=np.int32)[pre_order] +
+            self.clade_sizes[pre_order] - 1
+        )
+        self.clades_post_order = np.empty(len(pre_order), dtype=np.int32)
+        self.clades_post_order[self.clade_post_positions[pre_order]] = pre_order
     
     def get_clade_children(self, clade_index: int) -> list[int]:
-        return (
-            [] if clade_index < self.num_leaves
-            else self.children[clade_index - self.num_leaves]
+        if clade_index < self.num_leaves:
+            return []
+        internal_clade_index = clade_index - self.num_leaves
+        return self.clade_children.indices[
+            self.clade_children.offsets[internal_clade_index]:self.clade_children.offsets[internal_clade_index + 1]
+        ].tolist()
+    
+    def get_clade_num_children(self, clade_index: int) -> int:
+        if clade_index < self.num_leaves:
+            return 0
+        internal_clade_index = clade_index - self.num_leaves
+        return int(
+            self.clade_children.offsets[internal_clade_index + 1] -
+            self.clade_children.offsets[internal_clade_index]
         )
     
     # def set_clade_children(self, clade_index: int, children: list[int]):
@@ -37,30 +152,33 @@ class SimplePhylogeny:
     #         [] if clade_index < self.num_leaves
     #         else self.children[clade_index - self.num_leaves]
     #     )
+
+    def get_clade_parent(self, clade_index: int) -> Optional[int]:
+        parent_index = int(self.clade_parents[clade_index])
+        return parent_index if parent_index >= 0 else None
     
+    def get_clades_post_order(
+        self, clade_index: Optional[int] = None
+    ) -> list[int]:
+        if clade_index is None:
+            return self.clades_post_order.tolist()
+        post_end = int(self.clade_post_positions[clade_index]) + 1
+        return self.clades_post_order[post_end - int(self.clade_sizes[clade_index]):post_end].tolist()
+
     def get_clade_height(self, clade_index: int) -> int:
-        return (
-            0 if clade_index < self.num_leaves
-            else 1 + max([
-                self.get_clade_height(subclade_index)
-                for subclade_index in self.get_clade_children(clade_index)
-            ])
-        )
+        return int(self.clade_heights[clade_index])
+
+    def get_clade_leaf_range(self, clade_index: int) -> tuple[int, int]:
+        leaf_start = int(self.clade_leaf_starts[clade_index])
+        return leaf_start, leaf_start + int(self.clade_num_leaves[clade_index])
         
     def get_leaves_in_order(
         self, clade_index: Optional[int] = None
     ) -> list[int]:
         if clade_index is None:
-            clade_index = self.root_clade_index
-        subclades = self.get_clade_children(clade_index)
-        if len(subclades) == 0:
-            return [clade_index]
-        else:
-            return [
-                leave
-                for subclade in subclades
-                for leave in self.get_leaves_in_order(subclade)
-            ]
+            return self.leaves_in_order.tolist()
+        leaf_start, leaf_end = self.get_clade_leaf_range(clade_index)
+        return self.leaves_in_order[leaf_start:leaf_end].tolist()
 
 class SimplePhylogenyWithDistances(SimplePhylogeny):
     max_distances: list[int]
@@ -68,15 +186,12 @@ class SimplePhylogenyWithDistances(SimplePhylogeny):
     def __init__(
         self,
         num_leaves: int,
-        children: list[list[int]],
+        children: Union[list[list[int]], CladeChildren],
         max_distances: list[int]
     ):
         super().__init__(num_leaves=num_leaves, children=children)
         if max_distances is None:
-            max_distances = [
-                self.get_clade_height(num_leaves + internal_clade_index)
-                for internal_clade_index in enumerate(children)
-            ]
+            max_distances = self.clade_heights[num_leaves:].tolist()
         self.max_distances = max_distances
     
     def get_clade_distance(self, clade_index: int):
@@ -91,7 +206,7 @@ class SimplePhylogenyWithBranchLengths(SimplePhylogeny):
     def __init__(
         self,
         num_leaves: int,
-        children: list[list[int]],
+        children: Union[list[list[int]], CladeChildren],
         branch_lengths: list[int]
     ):
         super().__init__(num_leaves=num_leaves, children=children)
@@ -147,65 +262,82 @@ def load_phylogeny_with_distances(
 def compact_phylogeny(
     input_phylogeny: SimplePhylogenyWithDistances
 ) -> SimplePhylogenyWithDistances:
-    def clades_to_descendants_at_distance(clade_indeces: list[int], distance: int) -> list[int]:
-        return [
-            descendant_clade
-            for child_clade_index in clade_indeces
-            for descendant_clade in clade_to_descendants_at_distance(child_clade_index, distance)
+    num_leaves = input_phylogeny.num_leaves
+    children_offsets = input_phylogeny.clade_children.offsets.tolist()
+    children_indices = input_phylogeny.clade_children.indices.tolist()
+
+    def get_clade_children(clade_index: int) -> list[int]:
+        if clade_index < num_leaves:
+            return []
+        return children_indices[
+            children_offsets[clade_index - num_leaves]:children_offsets[clade_index - num_leaves + 1]
         ]
 
     def clade_to_descendants_at_distance(clade_index: int, distance: int) -> list[int]:
-        if input_phylogeny.get_clade_distance(clade_index) < distance:
-            return [clade_index]
-        descendant_clades_at_distance = clades_to_descendants_at_distance(
-            input_phylogeny.get_clade_children(clade_index), distance
-        )
-        if len(descendant_clades_at_distance) == 0:
-            return [clade_index]
+        descendant_clades_at_distance = []
+        clades_to_visit = list(reversed(get_clade_children(clade_index)))
+        while len(clades_to_visit) > 0:
+            descendant_clade = clades_to_visit.pop()
+            descendant_subclades = get_clade_children(descendant_clade)
+            if (input_phylogeny.get_clade_distance(descendant_clade) < distance or
+                len(descendant_subclades) == 0
+            ):
+                descendant_clades_at_distance.append(descendant_clade)
+            else:
+                clades_to_visit.extend(reversed(descendant_subclades))
         return descendant_clades_at_distance
     
     new_internal_clades_distances = []
-    new_internal_clades_children = []
-    
-    def compact_clade(clade_index: int) -> int:
-        subclades = input_phylogeny.get_clade_children(clade_index)
-        max_distance = input_phylogeny.get_clade_distance(clade_index)
-        if len(subclades) == 0:
-            return clade_index
-        descendants = clades_to_descendants_at_distance(
-            subclades,
-            max_distance
-        )
-        new_internal_clades_children.append([compact_clade(clade) for clade in descendants])
-        new_internal_clades_distances.append(max_distance)
-        new_clade_index = input_phylogeny.num_leaves + len(new_internal_clades_distances) - 1
-        return new_clade_index 
+    new_children_offsets = [0]
+    new_children_indices = []
+    new_clade_indices = {}
 
-    new_root_clade_index = compact_clade(input_phylogeny.root_clade_index)
+    clades_to_visit = [(input_phylogeny.root_clade_index, None)]
+    while len(clades_to_visit) > 0:
+        clade_index, descendants = clades_to_visit.pop()
+        if len(get_clade_children(clade_index)) == 0:
+            new_clade_indices[clade_index] = clade_index
+        elif descendants is None:
+            descendants = clade_to_descendants_at_distance(
+                clade_index,
+                input_phylogeny.get_clade_distance(clade_index)
+            )
+            clades_to_visit.append((clade_index, descendants))
+            clades_to_visit.extend((descendant, None) for descendant in reversed(descendants))
+        else:
+            new_children_indices.extend(new_clade_indices.pop(clade) for clade in descendants)
+            new_children_offsets.append(len(new_children_indices))
+            new_internal_clades_distances.append(input_phylogeny.get_clade_distance(clade_index))
+            new_clade_indices[clade_index] = num_leaves + len(new_internal_clades_distances) - 1
     
     return SimplePhylogenyWithDistances(
-        num_leaves=input_phylogeny.num_leaves,
-        children=new_internal_clades_children,
+        num_leaves=num_leaves,
+        children=CladeChildren(
+            offsets=np.array(new_children_offsets, dtype=np.int32),
+            indices=np.array(new_children_indices, dtype=np.int32)
+        ),
         max_distances=new_internal_clades_distances
     )
     
 def distances_to_branch_lengths(
     input_phylogeny: SimplePhylogenyWithDistances
 ) -> SimplePhylogenyWithBranchLengths:
-    branch_lengths = [0] * (input_phylogeny.num_clades)
-    def set_clade_branch_length(clade_index: int):
-        for subclade_index in input_phylogeny.get_clade_children(clade_index):
-            branch_lengths[subclade_index] = (
-                input_phylogeny.get_clade_distance(clade_index) -
-                input_phylogeny.get_clade_distance(subclade_index)
-            ) / 2
-            set_clade_branch_length(subclade_index)
-    
-    set_clade_branch_length(input_phylogeny.root_clade_index)
+    clade_distances = np.concatenate([
+        np.zeros(input_phylogeny.num_leaves),
+        np.asarray(input_phylogeny.max_distances, dtype=np.float64)
+    ])
+    clade_parents = input_phylogeny.clade_parents
+    has_parent = clade_parents >= 0
+    branch_lengths = np.zeros(input_phylogeny.num_clades)
+    branch_lengths[has_parent] = (
+        clade_distances[clade_parents[has_parent]] - clade_distances[has_parent]
+    ) / 2
+    branch_lengths = branch_lengths.tolist()
+    branch_lengths[input_phylogeny.root_clade_index] = 0
     
     return SimplePhylogenyWithBranchLengths(
         num_leaves=input_phylogeny.num_leaves,
-        children=input_phylogeny.children,
+        children=input_phylogeny.clade_children,
         branch_lengths=branch_lengths
     )
     
@@ -215,46 +347,36 @@ def build_phylogeny(
     items_as_seq_features: list[SeqFeature]
 ) -> Phylogeny:
     
-    def build_clade(clade_index: int):
+    built_clades = {}
+    for clade_index in simple_phylogeny.get_clades_post_order():
         subclade_indices = simple_phylogeny.get_clade_children(clade_index)
         branch_length = simple_phylogeny.get_branch_length(clade_index)
         if len(subclade_indices) == 0:
-            return feature_to_leave(items_as_seq_features[clade_index], branch_length=branch_length)
-        subclades = [build_clade(subclade_index) for subclade_index in subclade_indices]
-        return Clade(clades=subclades, branch_length=branch_length)
+            built_clades[clade_index] = feature_to_leave(items_as_seq_features[clade_index], branch_length=branch_length)
+        else:
+            subclades = [built_clades.pop(subclade_index) for subclade_index in subclade_indices]
+            built_clades[clade_index] = Clade(clades=subclades, branch_length=branch_length)
         
-    root_clade = build_clade(simple_phylogeny.root_clade_index)
+    root_clade = built_clades[simple_phylogeny.root_clade_index]
     phylogeny = new_phylogeny(root_clade)
 
     return phylogeny
 
-@dataclass
-class CladeSortResult:
-    subclade_index: int
-    min_index: int    
-
 def sort_by_leaf_indexes(phylogeny: SimplePhylogeny):
     
-    def sort_clade_by_leaf_indices(clade_index: int):
-        if len(phylogeny.get_clade_children(clade_index)) == 0:
-            return clade_index
-        subclade_results = [
-            CladeSortResult(
-                subclade_index,
-                sort_clade_by_leaf_indices(subclade_index)
-            )
-            for subclade_index in phylogeny.get_clade_children(clade_index)
-        ]
-        subclade_results.sort(
-            key=lambda c: c.min_index
-        )
-        phylogeny.children[clade_index - phylogeny.num_leaves] = [
-            subclade_result.subclade_index
-            for subclade_result in subclade_results
-        ]
-        return subclade_results[0].min_index
-    
-    sort_clade_by_leaf_indices(phylogeny.root_clade_index)
+    min_indices = list(range(phylogeny.num_clades))
+    clade_parents = phylogeny.clade_parents.tolist()
+    for clade_index in phylogeny.get_clades_post_order():
+        parent_index = clade_parents[clade_index]
+        if parent_index >= 0 and min_indices[clade_index] < min_indices[parent_index]:
+            min_indices[parent_index] = min_indices[clade_index]
+    offsets = phylogeny.clade_children.offsets
+    indices = phylogeny.clade_children.indices
+    children_order = np.lexsort((
+        np.array(min_indices, dtype=np.int32)[indices],
+        np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    ))
+    phylogeny.children = CladeChildren(offsets=offsets, indices=indices[children_order])
         
 def get_clades_by_level(
     phylogeny: SimplePhylogeny
@@ -271,26 +393,303 @@ def get_clades_by_level(
         clades_by_level[clade_height].append(clade_index)
         children_num_by_level[clade_height].append(children_num)
 
-    def extract_clades_by_height(clade_index: int):
-        subclade_indices = phylogeny.get_clade_children(clade_index)
-        subclade_heights = [
-            phylogeny.get_clade_height(subclade_index)
-            for subclade_index in subclade_indices
-        ]
-        clade_height = (
-            0 if len(subclade_indices) == 0
-            else 1 + max(subclade_heights)
+    clade_heights = phylogeny.clade_heights.tolist()
+    clade_parents = phylogeny.clade_parents.tolist()
+    for clade_index in phylogeny.get_clades_post_order():
+        clade_height = clade_heights[clade_index]
+        parent_index = clade_parents[clade_index]
+        set_by_height(
+            clade_height=clade_height,
+            clade_index=clade_index,
+            children_num=phylogeny.get_clade_num_children(clade_index)
         )
-        for subclade_position, subclade_height in enumerate(subclade_heights):
-            subclade_index = subclade_indices[subclade_position]
-            extract_clades_by_height(subclade_index)
-            for height in range(subclade_height + 1, clade_height):
-                set_by_height(clade_height=height, clade_index=subclade_indices[subclade_position], children_num=1)            
-        set_by_height(clade_height=clade_height, clade_index=clade_index, children_num=len(subclade_indices))
-
-    extract_clades_by_height(phylogeny.root_clade_index)
+        parent_height = clade_heights[parent_index] if parent_index >= 0 else 0
+        for height in range(clade_height + 1, parent_height):
+            set_by_height(clade_height=height, clade_index=clade_index, children_num=1)
     return clades_by_level, children_num_by_level
 
+@dataclass
+class LinkageClustering:
+    n_leaves_: int
+    children_: np.ndarray
+    distances_: np.ndarray
+
+def triu_to_clustering(
+    dist_triu: np.ndarray,
+    linkage: str = 'single'
+) -> LinkageClustering:
+    linkage_matrix = linkage_matrix_from_triu(dist_triu, method=linkage)
+    return LinkageClustering(
+        n_leaves_=len(linkage_matrix) + 1,
+        children_=linkage_matrix[:, :2].astype(int),
+        distances_=linkage_matrix[:, 2]
+    )
+
+def spanning_edges_to_clustering(
+    num_items: int,
+    edge_rows: np.ndarray,
+    edge_cols: np.ndarray,
+    edge_distances: np.ndarray,
+    disconnected_distance: Optional[float] = None
+) -> LinkageClustering:
+    edges_order = np.argsort(edge_distances, kind='stable')
+
+    parents = list(range(num_items))
+    clusters = list(range(num_items))
+    children = []
+    distances = []
+
+    def find_root(item: int) -> int:
+        while parents[item] != item:
+            parents[item] = parents[parents[item]]
+            item = parents[item]
+        return item
+
+    for edge in edges_order:
+        row_root = find_root(int(edge_rows[edge]))
+        col_root = find_root(int(edge_cols[edge]))
+        parents[col_root] = row_root
+        children.append([clusters[row_root], clusters[col_root]])
+        distances.append(edge_distances[edge])
+        clusters[row_root] = num_items + len(children) - 1
+
+    roots = [item for item in range(num_items) if parents[item] == item]
+    if len(roots) > 1:
+        if disconnected_distance is None:
+            disconnected_distance = (max(distances) if len(distances) > 0 else 0) + 1
+        merged_cluster = clusters[roots[0]]
+        for root in roots[1:]:
+            children.append([merged_cluster, clusters[root]])
+            distances.append(disconnected_distance)
+            merged_cluster = num_items + len(children) - 1
+
+    return LinkageClustering(
+        n_leaves_=num_items,
+        children_=np.array(children, dtype=int).reshape(-1, 2),
+        distances_=np.array(distances, dtype=np.float64)
+    )
+
+def sparse_to_clustering(
+    dist_graph: scipy.sparse.spmatrix,
+    linkage: str = 'single',
+    disconnected_distance: Optional[float] = None
+) -> LinkageClustering:
+    if linkage != 'single':
+        raise Exception(f'Sparse distance graphs only support single linkage, not {linkage}')
+    num_items = dist_graph.shape[0]
+    edges = scipy.sparse.coo_matrix(dist_graph)
+    off_diagonal = edges.row != edges.col
+    spanning_tree = minimum_spanning_tree(scipy.sparse.coo_matrix(
+        (
+            edges.data[off_diagonal].astype(np.float64) + 1,
+            (edges.row[off_diagonal], edges.col[off_diagonal])
+        ),
+        shape=(num_items, num_items)
+    )).tocoo()
+    return spanning_edges_to_clustering(
+        num_items,
+        spanning_tree.row,
+        spanning_tree.col,
+        spanning_tree.data - 1,
+        disconnected_distance=disconnected_distance
+    )
+
+def distance_row(dist_matrix, num_items: int, row: int) -> np.ndarray:
+    if hasattr(dist_matrix, 'get_row'):
+        return dist_matrix.get_row(row)
+    return matrix_row(dist_matrix, num_items, row)
+
+def prim_spanning_edges(dist_matrix) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    num_items = matrix_size(dist_matrix)
+    num_edges = max(0, num_items - 1)
+    remaining = np.arange(1, num_items)
+    min_distances = np.full(num_edges, np.inf)
+    nearest = np.zeros(num_edges, dtype=np.int64)
+    edge_rows = np.empty(num_edges, dtype=np.int64)
+    edge_cols = np.empty(num_edges, dtype=np.int64)
+    edge_distances = np.empty(num_edges, dtype=np.float64)
+    num_remaining = num_edges
+    current = 0
+    for step in range(num_edges):
+        row = distance_row(dist_matrix, num_items, current)[remaining[:num_remaining]]
+        closer = row < min_distances[:num_remaining]
+        min_distances[:num_remaining][closer] = row[closer]
+        nearest[:num_remaining][closer] = current
+        best = int(np.argmin(min_distances[:num_remaining]))
+        current = int(remaining[best])
+        edge_rows[step] = nearest[best]
+        edge_cols[step] = current
+        edge_distances[step] = min_distances[best]
+        num_remaining -= 1
+        remaining[best] = remaining[num_remaining]
+        min_distances[best] = min_distances[num_remaining]
+        nearest[best] = nearest[num_remaining]
+    return edge_rows, edge_cols, edge_distances
+
+def prim_single_linkage(dist_matrix) -> LinkageClustering:
+    return spanning_edges_to_clustering(
+        matrix_size(dist_matrix),
+        *prim_spanning_edges(dist_matrix)
+    )
+
+def distance_sub_matrix(dist_matrix, num_items: int, items: np.ndarray) -> np.ndarray:
+    if hasattr(dist_matrix, 'get_row'):
+        return np.stack([dist_matrix.get_row(int(item))[items] for item in items])
+    if dist_matrix.ndim == 1:
+        return triu_lookup(dist_matrix, num_items, items[:, None], items[None, :])
+    return np.asarray(dist_matrix[np.ix_(items, items)])
+
+def union_pairs(labels: np.ndarray, rows: np.ndarray, cols: np.ndarray):
+    while True:
+        row_labels = labels[rows]
+        col_labels = labels[cols]
+        different = row_labels != col_labels
+        if not different.any():
+            return
+        np.minimum.at(
+            labels,
+            np.maximum(row_labels, col_labels)[different],
+            np.minimum(row_labels, col_labels)[different]
+        )
+        while True:
+            next_labels = labels[labels]
+            if np.array_equal(next_labels, labels):
+                break
+            labels[:] = next_labels
+
+def threshold_components(
+    dist_matrix,
+    threshold: float,
+    rows_per_batch: int = 1024
+) -> np.ndarray:
+    num_items = matrix_size(dist_matrix)
+    labels = np.arange(num_items)
+    for row_start in range(0, num_items, rows_per_batch):
+        rows = []
+        cols = []
+        for row in range(row_start, min(row_start + rows_per_batch, num_items)):
+            neighbours = np.nonzero(distance_row(dist_matrix, num_items, row)[row + 1:] <= threshold)[0]
+            rows.append(np.full(len(neighbours), row))
+            cols.append(neighbours + row + 1)
+        union_pairs(labels, np.concatenate(rows), np.concatenate(cols))
+    return labels
+
+class ComponentDistanceMatrix:
+    dist_matrix: object
+    num_items: int
+    component_items: list[np.ndarray]
+    ndim: int = 2
+
+    def __init__(self, dist_matrix, labels: np.ndarray):
+        self.dist_matrix = dist_matrix
+        self.num_items = len(labels)
+        self.items_order = np.argsort(labels, kind='stable')
+        sorted_labels = labels[self.items_order]
+        self.component_starts = np.nonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]])[0]
+        self.component_items = np.split(self.items_order, self.component_starts[1:])
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (len(self.component_items), len(self.component_items))
+
+    def get_row(self, component: int, rows_per_batch: int = 256) -> np.ndarray:
+        row = np.full(len(self.component_items), np.inf)
+        items = self.component_items[component]
+        for batch_start in range(0, len(items), rows_per_batch):
+            item_rows = np.stack([
+                distance_row(self.dist_matrix, self.num_items, int(item))
+                for item in items[batch_start:batch_start + rows_per_batch]
+            ])
+            np.minimum(
+                row,
+                np.minimum.reduceat(item_rows[:, self.items_order], self.component_starts, axis=1).min(axis=0),
+                out=row
+            )
+        row[component] = 0
+        return row
+
+def component_single_linkage(
+    dist_matrix,
+    threshold: float,
+    max_num_processes: Optional[int] = None
+) -> LinkageClustering:
+    num_items = matrix_size(dist_matrix)
+    if num_items < 2:
+        return prim_single_linkage(dist_matrix)
+    component_matrix = ComponentDistanceMatrix(
+        dist_matrix,
+        threshold_components(dist_matrix, threshold)
+    )
+    component_items = [
+        items for items in component_matrix.component_items
+        if len(items) > 1
+    ]
+    print(
+        f"Components within distance {threshold}: {len(component_matrix.component_items)}, " +
+        f"largest: {max([len(items) for items in component_matrix.component_items])}"
+    )
+    edge_rows = []
+    edge_cols = []
+    edge_distances = []
+    if len(component_items) > 0:
+        with Pool(max_num_processes) as p:
+            for items, (rows, cols, distances) in zip(
+                component_items,
+                p.imap(
+                    prim_spanning_edges,
+                    (distance_sub_matrix(dist_matrix, num_items, items) for items in component_items)
+                )
+            ):
+                edge_rows.append(items[rows])
+                edge_cols.append(items[cols])
+                edge_distances.append(distances)
+            p.close()
+            p.join()
+    if len(component_matrix.component_items) > 1:
+        rows, cols, distances = prim_spanning_edges(component_matrix)
+        representatives = np.array([items[0] for items in component_matrix.component_items])
+        edge_rows.append(representatives[rows])
+        edge_cols.append(representatives[cols])
+        edge_distances.append(distances)
+    return spanning_edges_to_clustering(
+        num_items,
+        np.concatenate(edge_rows),
+        np.concatenate(edge_cols),
+        np.concatenate(edge_distances)
+    )
+
+def attach_duplicate_leaves(
+    unique_phylogeny: SimplePhylogenyWithDistances,
+    item_to_unique: np.ndarray
+) -> SimplePhylogenyWithDistances:
+    num_items = len(item_to_unique)
+    items_by_unique = [[] for _ in range(unique_phylogeny.num_leaves)]
+    for item_index, unique_index in enumerate(item_to_unique):
+        items_by_unique[unique_index].append(item_index)
+    duplicates_children = []
+    unique_leaf_to_clade = []
+    for items in items_by_unique:
+        if len(items) == 1:
+            unique_leaf_to_clade.append(items[0])
+        else:
+            unique_leaf_to_clade.append(num_items + len(duplicates_children))
+            duplicates_children.append(items)
+    internal_clades_offset = num_items + len(duplicates_children) - unique_phylogeny.num_leaves
+
+    def unique_to_clade(clade_index: int) -> int:
+        if clade_index < unique_phylogeny.num_leaves:
+            return unique_leaf_to_clade[clade_index]
+        return clade_index + internal_clades_offset
+
+    return SimplePhylogenyWithDistances(
+        num_leaves=num_items,
+        children=duplicates_children + [
+            [unique_to_clade(subclade) for subclade in subclades]
+            for subclades in unique_phylogeny.children
+        ],
+        max_distances=[0] * len(duplicates_children) + list(unique_phylogeny.max_distances)
+    )
+
 @dataclass
 class ClusteringToPhylogenyResult:
     phylogeny: Phylogeny
@@ -302,30 +701,59 @@ def clustering_to_phylogeny(
     items_as_seq_records: Optional[list[SeqRecord]] = None,
     items_as_seq_features: Optional[list[SeqFeature]] = None,
     seq_references: Optional[dict[SeqRecord]] = None,
-    dist_matrix: Optional[np.ndarray] = None,
+    dist_matrix: Optional[Union[np.ndarray, DeduplicatedMatrix, scipy.sparse.spmatrix]] = None,
     compute_distances: bool = True,
     linkage : str = 'single',
     metric : str = 'euclidean',
-    sort: bool = True
+    sort: bool = True,
+    disconnected_distance: Optional[float] = None,
+    kmer_size: Optional[int] = None,
+    component_threshold: Optional[float] = None,
+    max_num_processes: Optional[int] = None
 ) -> ClusteringToPhylogenyResult:
-    
+
+    if (dist_matrix is not None and
+        not isinstance(dist_matrix, (np.ndarray, DeduplicatedMatrix)) and
+        not scipy.sparse.issparse(dist_matrix) and
+        not hasattr(dist_matrix, 'get_row')
+    ):
+        dist_matrix = np.asarray(dist_matrix)
+
+    if dist_matrix is not None:
+        dist_matrix_size = (
+            dist_matrix.num_items if isinstance(dist_matrix, DeduplicatedMatrix)
+            else matrix_size(dist_matrix)
+        )
+
     assert_equal([
         'clustering.n_leaves_',
         'len(item_vs_position_array)',
         'len(items_as_seq_records)',
         'len(items_as_seq_features)',
-        'dist_matrix.shape[0]',
+        'dist_matrix_size',
         'dist_matrix.shape[1]'
     ], locals=locals())
     
-    if clustering is None:
-        clustering = AgglomerativeClustering(
-            metric=metric if dist_matrix is None else 'precomputed',
-            compute_full_tree=True,
-            linkage=linkage,
-            compute_distances = compute_distances,
-            n_clusters=1)
+    if (clustering is None and
+        isinstance(dist_matrix, DeduplicatedMatrix) and
+        linkage != 'single'
+    ):
+        expanded_matrix = np.asarray(dist_matrix)
+        dist_matrix = (
+            matrix_to_triu(expanded_matrix) if dist_matrix.unique_matrix.ndim == 1
+            else expanded_matrix
+        )
 
+    deduplicated_matrix = None
+    if isinstance(dist_matrix, DeduplicatedMatrix):
+        deduplicated_matrix = dist_matrix
+        dist_matrix = deduplicated_matrix.unique_matrix
+        if clustering is None and deduplicated_matrix.num_unique == 1:
+            clustering = LinkageClustering(
+                n_leaves_=1,
+                children_=np.zeros((0, 2), dtype=int),
+                distances_=np.zeros(0)
+            )
 
     if (items_as_seq_features is not None and
         seq_references is not None and
@@ -342,6 +770,54 @@ def clustering_to_phylogeny(
             for seq_record in items_as_seq_records
         ]
     
+    if (clustering is None and
+        dist_matrix is None and
+        item_vs_position_array is None and
+        kmer_size is not None
+    ):
+        if items_as_seq_records is None:
+            raise Exception('k-mer distances need the item sequences')
+        dist_matrix = (
+            seqs_kmer_distance_matrix(items_as_seq_records, k=kmer_size) if linkage == 'single'
+            else seqs_kmer_distance_triu(items_as_seq_records, k=kmer_size)
+        )
+
+    if clustering is None and dist_matrix is not None and scipy.sparse.issparse(dist_matrix):
+        clustering = sparse_to_clustering(
+            dist_matrix,
+            linkage=linkage,
+            disconnected_distance=disconnected_distance
+        )
+
+    if clustering is None and dist_matrix is not None and hasattr(dist_matrix, 'single_linkage_clustering'):
+        if linkage != 'single' or component_threshold is not None:
+            raise Exception('Tile-backed distance matrices only support single linkage without component_threshold')
+        clustering = dist_matrix.single_linkage_clustering(max_num_processes=max_num_processes)
+
+    if clustering is None and dist_matrix is not None and component_threshold is not None:
+        if linkage != 'single':
+            raise Exception(f'Threshold components only support single linkage, not {linkage}')
+        clustering = component_single_linkage(
+            dist_matrix,
+            threshold=component_threshold,
+            max_num_processes=max_num_processes
+        )
+
+    if clustering is None and dist_matrix is not None and linkage == 'single':
+        clustering = prim_single_linkage(dist_matrix)
+
+    if clustering is None and dist_matrix is not None and dist_matrix.ndim == 1:
+        clustering = triu_to_clustering(dist_matrix, linkage=linkage)
+
+    if clustering is None:
+        clustering = AgglomerativeClustering(
+            metric=metric if dist_matrix is None else 'precomputed',
+            compute_full_tree=True,
+            linkage=linkage,
+            compute_distances = compute_distances,
+            n_clusters=1)
+
+
     if items_as_seq_features is None:
         raise Exception("No information on sequence positions")
 
@@ -361,8 +837,12 @@ def clustering_to_phylogeny(
             else:
                 raise Exception('No data available to perform clustering')
     
+    num_clustered_items = (
+        len(items_as_seq_features) if deduplicated_matrix is None
+        else deduplicated_matrix.num_unique
+    )
     assert_equal(
-        ['len(items_as_seq_features)','clustering.n_leaves_'],
+        ['num_clustered_items','clustering.n_leaves_'],
         locals=locals(),
         error_template_fun=(
             lambda values: f"Clustering returned wrong numer of leaves: {values[1][1]} instead of {values[0][1]}"
@@ -375,6 +855,12 @@ def clustering_to_phylogeny(
         max_distances=[int(distance) for distance in clustering.distances_] if hasattr(clustering, 'distances_') else None
     )
 
+    if deduplicated_matrix is not None:
+        aggregation_result = attach_duplicate_leaves(
+            aggregation_result,
+            item_to_unique=deduplicated_matrix.item_to_unique
+        )
+
     compacted_result = compact_phylogeny(aggregation_result)
     simple_phylogeny = distances_to_branch_lengths(compacted_result)
     
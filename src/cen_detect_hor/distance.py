@@ -18,8 +18,10 @@ def build_seqs_distance_matrix(seqs: list[SeqRecord]) -> np.ndarray:
 
 
 def min_distance(distance_matrix: np.ndarray) -> any:
-    return min(distance_matrix[np.triu_indices(distance_matrix.shape[0],1)])
+    return min(distance_values(distance_matrix))
 
 
 def distance_values(matrix: np.ndarray):
-    return matrix[np.triu_indices(matrix.shape[0], k = 1)]
\ No newline at end of file
+    if matrix.ndim == 1:
+        return matrix
+    return matrix[np.triu_indices(matrix.shape[0], k = 1)]
@@ -0,0 +1,324 @@
+from dataclasses import dataclass
+import math
+from typing import Callable, Optional
+import numpy as np
+import editdistance
+
+WORD_SIZE = 64
+DEFAULT_MAX_PAIRS_PER_BATCH = 2**14
+DEFAULT_MAX_SYMBOLS_PER_BATCH = 2**22
+DEFAULT_BAND_CHECK_INTERVAL = 16
+
+@dataclass
+class EncodedStrings:
+    codes: np.ndarray
+    lengths: np.ndarray
+
+    def __len__(self):
+        return len(self.lengths)
+
+def encode_string_sets(
+    string_sets: list[list[str]]
+) -> tuple[list[EncodedStrings], int]:
+    all_symbols = np.frombuffer(
+        ''.join([''.join(strings) for strings in string_sets]).encode('utf-32-le'),
+        dtype=np.uint32
+    )
+    alphabet, symbol_codes = np.unique(all_symbols, return_inverse=True)
+    if len(alphabet) > 255:
+        raise Exception(f'Too many distinct symbols for uint8 encoding: {len(alphabet)}')
+    padding_code = len(alphabet)
+    encoded_sets = []
+    symbol_offset = 0
+    for strings in string_sets:
+        lengths = np.array([len(string) for string in strings], dtype=np.int64)
+        codes = np.full(
+            (len(strings), int(lengths.max(initial=0))),
+            padding_code, dtype=np.uint8
+        )
+        num_symbols = int(lengths.sum())
+        codes[np.arange(codes.shape[1]) < lengths[:, None]] = (
+            symbol_codes[symbol_offset:symbol_offset + num_symbols]
+        )
+        symbol_offset += num_symbols
+        encoded_sets.append(EncodedStrings(codes=codes, lengths=lengths))
+    return encoded_sets, len(alphabet) + 1
+
+def build_pattern_match_vectors(
+    patterns: EncodedStrings,
+    alphabet_size: int
+) -> np.ndarray:
+    num_words = max(1, math.ceil(patterns.codes.shape[1] / WORD_SIZE))
+    match_vectors = np.zeros(
+        (num_words, len(patterns), alphabet_size),
+        dtype=np.uint64
+    )
+    pattern_indices, positions = np.nonzero(
+        np.arange(patterns.codes.shape[1]) < patterns.lengths[:, None]
+    )
+    np.bitwise_or.at(
+        match_vectors,
+        (
+            positions // WORD_SIZE,
+            pattern_indices,
+            patterns.codes[pattern_indices, positions]
+        ),
+        np.left_shift(np.uint64(1), (positions % WORD_SIZE).astype(np.uint64))
+    )
+    return match_vectors
+
+def pattern_word_masks(pattern_lengths: np.ndarray, num_words: int) -> np.ndarray:
+    word_bits = np.clip(
+        pattern_lengths[None, :] - WORD_SIZE * np.arange(num_words)[:, None],
+        0, WORD_SIZE
+    ).astype(np.uint64)
+    return np.where(
+        word_bits == WORD_SIZE,
+        np.iinfo(np.uint64).max,
+        (np.uint64(1) << word_bits) - np.uint64(1)
+    )[:, :, None]
+
+def build_byte_prefix_tables() -> tuple[np.ndarray, np.ndarray]:
+    positive_bits = np.arange(256)[:, None] >> np.arange(8)[None, :] & 1
+    deltas = positive_bits[:, None, :] - positive_bits[None, :, :]
+    prefix_sums = np.cumsum(deltas, axis=2)
+    return (
+        prefix_sums[:, :, -1].reshape(-1).astype(np.int64),
+        prefix_sums.min(axis=2).reshape(-1).astype(np.int64)
+    )
+
+byte_prefix_sums, byte_prefix_minima = build_byte_prefix_tables()
+
+def vertical_deltas_min_prefix(
+    positive_vertical: np.ndarray,
+    negative_vertical: np.ndarray
+) -> np.ndarray:
+    byte_mask = np.uint64(0xFF)
+    prefix_sum = np.zeros(positive_vertical.shape[1], dtype=np.int64)
+    prefix_min = np.zeros(positive_vertical.shape[1], dtype=np.int64)
+    for word in range(positive_vertical.shape[0]):
+        for byte_shift in range(0, WORD_SIZE, 8):
+            shift = np.uint64(byte_shift)
+            byte_pairs = (
+                ((positive_vertical[word] >> shift) & byte_mask) << np.uint64(8)
+                | ((negative_vertical[word] >> shift) & byte_mask)
+            )
+            np.minimum(prefix_min, prefix_sum + byte_prefix_minima[byte_pairs], out=prefix_min)
+            prefix_sum += byte_prefix_sums[byte_pairs]
+    return prefix_min
+
+def bit_parallel_distances(
+    match_vectors: np.ndarray,
+    pattern_lengths: np.ndarray,
+    texts: EncodedStrings,
+    pattern_indices: np.ndarray,
+    text_indices: np.ndarray,
+    max_distance: Optional[int] = None,
+    band_check_interval: int = DEFAULT_BAND_CHECK_INTERVAL
+) -> np.ndarray:
+    num_words, _, alphabet_size = match_vectors.shape
+    one = np.uint64(1)
+    high_bit_shift = np.uint64(WORD_SIZE - 1)
+    word_masks = pattern_word_masks(pattern_lengths, num_words)[:, :, 0]
+
+    pair_pattern_lengths = pattern_lengths[pattern_indices]
+    pair_text_lengths = texts.lengths[text_indices]
+    distances = np.abs(pair_pattern_lengths - pair_text_lengths)
+    empty_texts = pair_text_lengths == 0
+    distances[empty_texts] = pair_pattern_lengths[empty_texts]
+    if max_distance is not None:
+        np.minimum(distances, max_distance, out=distances)
+        check_band = np.maximum(pair_pattern_lengths, pair_text_lengths) > max_distance
+        pairs = np.nonzero((distances < max_distance) & ~empty_texts)[0]
+    else:
+        check_band = np.zeros(len(distances), dtype=bool)
+        pairs = np.nonzero(~empty_texts)[0]
+
+    text_lengths = pair_text_lengths[pairs]
+    band_pairs = check_band[pairs]
+    masks = word_masks[:, pattern_indices[pairs]]
+    pair_match_vectors = np.ascontiguousarray(match_vectors[:, pattern_indices[pairs], :])
+    codes = np.ascontiguousarray(texts.codes[text_indices[pairs]].T)
+    positive_vertical = np.full(
+        (num_words, len(pairs)), np.iinfo(np.uint64).max, dtype=np.uint64
+    )
+    negative_vertical = np.zeros((num_words, len(pairs)), dtype=np.uint64)
+    done = np.zeros(len(pairs), dtype=bool)
+
+    text_position = 0
+    while len(pairs) > 0:
+        num_pairs = len(pairs)
+        flat_match_vectors = pair_match_vectors.reshape(num_words, num_pairs * alphabet_size)
+        match_indices = np.arange(num_pairs) * alphabet_size + codes[text_position]
+        carry_positive = np.ones(num_pairs, dtype=np.uint64)
+        carry_negative = np.zeros(num_pairs, dtype=np.uint64)
+        xv = np.empty(num_pairs, dtype=np.uint64)
+        xh = np.empty(num_pairs, dtype=np.uint64)
+        ph = np.empty(num_pairs, dtype=np.uint64)
+        mh = np.empty(num_pairs, dtype=np.uint64)
+        for word in range(num_words):
+            pv = positive_vertical[word]
+            mv = negative_vertical[word]
+            eq = np.take(flat_match_vectors[word], match_indices)
+            np.bitwise_or(eq, mv, out=xv)
+            eq |= carry_negative
+            np.bitwise_and(eq, pv, out=xh)
+            xh += pv
+            xh ^= pv
+            xh |= eq
+            np.bitwise_or(xh, pv, out=ph)
+            np.invert(ph, out=ph)
+            ph |= mv
+            np.bitwise_and(pv, xh, out=mh)
+            next_carry_positive = ph >> high_bit_shift
+            next_carry_negative = mh >> high_bit_shift
+            ph <<= one
+            ph |= carry_positive
+            mh <<= one
+            mh |= carry_negative
+            np.bitwise_or(xv, ph, out=pv)
+            np.invert(pv, out=pv)
+            pv |= mh
+            np.bitwise_and(ph, xv, out=mv)
+            carry_positive = next_carry_positive
+            carry_negative = next_carry_negative
+        text_position += 1
+
+        finished = np.nonzero(text_lengths == text_position)[0]
+        if len(finished) > 0:
+            distances[pairs[finished]] = text_position + (
+                np.bitwise_count(positive_vertical[:, finished] & masks[:, finished]).sum(axis=0, dtype=np.int64)
+                - np.bitwise_count(negative_vertical[:, finished] & masks[:, finished]).sum(axis=0, dtype=np.int64)
+            )
+            done[finished] = True
+        if (
+            max_distance is not None and
+            text_position % band_check_interval == 0 and
+            band_pairs.any()
+        ):
+            out_of_band = band_pairs & ~done & (
+                text_position + vertical_deltas_min_prefix(
+                    positive_vertical & masks,
+                    negative_vertical & masks
+                ) >= max_distance
+            )
+            distances[pairs[out_of_band]] = max_distance
+            done |= out_of_band
+
+        num_done = np.count_nonzero(done)
+        if num_done == num_pairs:
+            break
+        if num_done * 4 >= num_pairs:
+            remaining = np.nonzero(~done)[0]
+            pairs = pairs[remaining]
+            text_lengths = text_lengths[remaining]
+            band_pairs = band_pairs[remaining]
+            masks = masks[:, remaining]
+            pair_match_vectors = np.ascontiguousarray(pair_match_vectors[:, remaining, :])
+            codes = np.ascontiguousarray(codes[:, remaining])
+            positive_vertical = positive_vertical[:, remaining]
+            negative_vertical = negative_vertical[:, remaining]
+            done = done[remaining]
+
+    if max_distance is not None:
+        np.minimum(distances, max_distance, out=distances)
+    return distances
+
+def bit_parallel_cross_distance_matrix(
+    row_strings: list[str],
+    col_strings: list[str],
+    max_pairs_per_batch: int = DEFAULT_MAX_PAIRS_PER_BATCH,
+    only_triu: bool = False,
+    max_distance: Optional[int] = None,
+    skip_pairs: Optional[np.ndarray] = None
+) -> np.ndarray:
+    (row_encoded, col_encoded), alphabet_size = encode_string_sets(
+        [row_strings, col_strings]
+    )
+    match_vectors = build_pattern_match_vectors(row_encoded, alphabet_size)
+    num_rows = len(row_encoded)
+    num_cols = len(col_encoded)
+    dist_matrix = np.zeros((num_rows, num_cols), dtype=np.int64)
+    rows_per_batch = max(1, max_pairs_per_batch // max(1, num_cols))
+    for row_start in range(0, num_rows, rows_per_batch):
+        row_end = min(row_start + rows_per_batch, num_rows)
+        col_start = row_start + 1 if only_triu else 0
+        if col_start >= num_cols:
+            continue
+        pattern_indices, text_indices = np.nonzero(
+            np.ones((row_end - row_start, num_cols - col_start), dtype=bool)
+            if skip_pairs is None
+            else ~skip_pairs[row_start:row_end, col_start:]
+        )
+        pattern_indices += row_start
+        text_indices += col_start
+        if only_triu:
+            upper_pairs = text_indices > pattern_indices
+            pattern_indices = pattern_indices[upper_pairs]
+            text_indices = text_indices[upper_pairs]
+        dist_matrix[pattern_indices, text_indices] = bit_parallel_distances(
+            match_vectors,
+            pattern_lengths=row_encoded.lengths,
+            texts=col_encoded,
+            pattern_indices=pattern_indices,
+            text_indices=text_indices,
+            max_distance=max_distance
+        )
+    if skip_pairs is not None:
+        dist_matrix[skip_pairs] = max_distance
+    return dist_matrix
+
+def bounded_edit_distance(
+    string_a: str,
+    string_b: str,
+    max_distance: Optional[int] = None
+) -> int:
+    if max_distance is None:
+        return editdistance.eval(string_a, string_b)
+    if abs(len(string_a) - len(string_b)) >= max_distance:
+        return max_distance
+    return min(editdistance.eval(string_a, string_b), max_distance)
+
+def hamming_cross_distance_matrix(
+    row_strings: list[str],
+    col_strings: list[str],
+    max_symbols_per_batch: int = DEFAULT_MAX_SYMBOLS_PER_BATCH,
+    only_triu: bool = False,
+    max_distance: Optional[int] = None,
+    unequal_length_distance: Callable[[str, str, Optional[int]], int] = bounded_edit_distance
+) -> np.ndarray:
+    (row_encoded, col_encoded), alphabet_size = encode_string_sets(
+        [row_strings, col_strings]
+    )
+    num_rows = len(row_encoded)
+    num_cols = len(col_encoded)
+    max_length = max(row_encoded.codes.shape[1], col_encoded.codes.shape[1])
+    row_codes, col_codes = [
+        np.pad(
+            encoded.codes,
+            ((0, 0), (0, max_length - encoded.codes.shape[1])),
+            constant_values=alphabet_size - 1
+        )
+        for encoded in [row_encoded, col_encoded]
+    ]
+    dist_matrix = np.zeros((num_rows, num_cols), dtype=np.int64)
+    rows_per_batch = max(1, max_symbols_per_batch // max(1, num_cols * max_length))
+    for row_start in range(0, num_rows, rows_per_batch):
+        row_end = min(row_start + rows_per_batch, num_rows)
+        col_start = row_start + 1 if only_triu else 0
+        if col_start >= num_cols:
+            continue
+        dist_matrix[row_start:row_end, col_start:] = np.count_nonzero(
+            row_codes[row_start:row_end, None, :] != col_codes[None, col_start:, :],
+            axis=2
+        )
+    unequal_length_pairs = row_encoded.lengths[:, None] != col_encoded.lengths[None, :]
+    if only_triu:
+        unequal_length_pairs = np.triu(unequal_length_pairs, k=1)
+    for row_index, col_index in zip(*np.nonzero(unequal_length_pairs)):
+        dist_matrix[row_index, col_index] = unequal_length_distance(
+            row_strings[row_index], col_strings[col_index], max_distance
+        )
+    if max_distance is not None:
+        np.minimum(dist_matrix, max_distance, out=dist_matrix)
+    return np.triu(dist_matrix, k=1) if only_triu else dist_matrix
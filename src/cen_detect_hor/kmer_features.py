@@ -0,0 +1,203 @@
+from typing import Union
+import numpy as np
+import scipy.sparse
+from Bio.SeqRecord import SeqRecord
+from .matrix_utils import set_triu_block, triu_size
+
+kmer_distance_metrics = ['sqeuclidean', 'euclidean', 'cosine']
+kmer_distance_dtypes = {
+    'sqeuclidean': np.uint32,
+    'euclidean': np.float32,
+    'cosine': np.float32
+}
+
+def check_kmer_distance_metric(metric: str):
+    if metric not in kmer_distance_metrics:
+        raise Exception(f'Unknown k-mer distance metric {metric}, expected one of {kmer_distance_metrics}')
+
+def encode_strings(strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    encoded_strings = [string.upper().encode() for string in strings]
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(encoded) for encoded in encoded_strings], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded_strings), dtype=np.uint8), offsets
+
+def kmer_count_matrix(
+    strings: list[str],
+    k: int = 4,
+    sparse: bool = True,
+    alphabet: str = 'ACGT'
+) -> Union[np.ndarray, scipy.sparse.csr_matrix]:
+    num_strings = len(strings)
+    alphabet_size = len(alphabet)
+    num_features = alphabet_size ** k
+    data, offsets = encode_strings(strings)
+    symbol_lookup = np.full(256, -1, dtype=np.int64)
+    symbol_lookup[np.frombuffer(alphabet.upper().encode(), dtype=np.uint8)] = np.arange(alphabet_size)
+    symbol_codes = symbol_lookup[data]
+
+    if len(symbol_codes) < k:
+        rows = np.zeros(0, dtype=np.int64)
+        cols = np.zeros(0, dtype=np.int64)
+    else:
+        windows = np.lib.stride_tricks.sliding_window_view(symbol_codes, k)
+        kmer_codes = windows @ (alphabet_size ** np.arange(k - 1, -1, -1, dtype=np.int64))
+        window_starts = np.arange(len(windows), dtype=np.int64)
+        window_strings = np.searchsorted(offsets, window_starts, side='right') - 1
+        valid_windows = (
+            (windows >= 0).all(axis=1) &
+            (window_starts + k <= offsets[window_strings + 1])
+        )
+        rows = window_strings[valid_windows]
+        cols = kmer_codes[valid_windows]
+
+    if sparse:
+        return scipy.sparse.coo_matrix(
+            (np.ones(len(rows), dtype=np.float64), (rows, cols)),
+            shape=(num_strings, num_features)
+        ).tocsr()
+    return np.bincount(
+        rows * num_features + cols,
+        minlength=num_strings * num_features
+    ).reshape(num_strings, num_features).astype(np.float64)
+
+def seqs_kmer_count_matrix(
+    seqs: list[SeqRecord],
+    k: int = 4,
+    sparse: bool = True,
+    alphabet: str = 'ACGT'
+) -> Union[np.ndarray, scipy.sparse.csr_matrix]:
+    return kmer_count_matrix(
+        [str(seq.seq) for seq in seqs],
+        k=k,
+        sparse=sparse,
+        alphabet=alphabet
+    )
+
+def row_squared_norms(features: Union[np.ndarray, scipy.sparse.spmatrix]) -> np.ndarray:
+    if scipy.sparse.issparse(features):
+        return np.asarray(features.multiply(features).sum(axis=1)).ravel()
+    return np.einsum('ij,ij->i', features, features)
+
+def dense_rows(
+    features: Union[np.ndarray, scipy.sparse.spmatrix],
+    start: int,
+    end: int,
+    dtype: np.dtype = np.float32
+) -> np.ndarray:
+    rows = features[start:end]
+    if scipy.sparse.issparse(rows):
+        rows = rows.toarray()
+    return np.ascontiguousarray(rows, dtype=dtype)
+
+def kmer_distance_triu(
+    features: Union[np.ndarray, scipy.sparse.spmatrix],
+    metric: str = 'sqeuclidean',
+    rows_per_batch: int = 1024
+) -> np.ndarray:
+    check_kmer_distance_metric(metric)
+    num_items = features.shape[0]
+    squared_norms = row_squared_norms(features)
+    if metric == 'cosine':
+        inverse_norms = np.divide(
+            1, np.sqrt(squared_norms),
+            out=np.zeros_like(squared_norms), where=squared_norms > 0
+        )
+        features = (
+            scipy.sparse.diags(inverse_norms) @ features if scipy.sparse.issparse(features)
+            else features * inverse_norms[:, None]
+        )
+    gram_dtype = np.float64 if metric == 'cosine' else np.float32
+    dist_triu = np.empty(triu_size(num_items), dtype=kmer_distance_dtypes[metric])
+    for row_start in range(0, num_items, rows_per_batch):
+        row_end = min(row_start + rows_per_batch, num_items)
+        row_features = dense_rows(features, row_start, row_end, dtype=gram_dtype)
+        for col_start in range(row_start, num_items, rows_per_batch):
+            col_end = min(col_start + rows_per_batch, num_items)
+            gram = (row_features @ dense_rows(features, col_start, col_end, dtype=gram_dtype).T).astype(np.float64)
+            if metric == 'cosine':
+                block = np.maximum(1 - gram, 0)
+            else:
+                block = np.maximum(
+                    squared_norms[row_start:row_end, None] +
+                    squared_norms[None, col_start:col_end] - 2 * gram,
+                    0
+                )
+                if metric == 'euclidean':
+                    np.sqrt(block, out=block)
+                else:
+                    np.rint(block, out=block)
+            set_triu_block(dist_triu, num_items, row_offset=row_start, col_offset=col_start, block=block)
+    return dist_triu
+
+def seqs_kmer_distance_triu(
+    seqs: list[SeqRecord],
+    k: int = 4,
+    metric: str = 'sqeuclidean',
+    alphabet: str = 'ACGT',
+    rows_per_batch: int = 1024
+) -> np.ndarray:
+    return kmer_distance_triu(
+        seqs_kmer_count_matrix(seqs, k=k, alphabet=alphabet),
+        metric=metric,
+        rows_per_batch=rows_per_batch
+    )
+
+class KmerDistanceMatrix:
+    features: np.ndarray
+    squared_norms: np.ndarray
+    metric: str
+    ndim: int = 2
+
+    def __init__(
+        self,
+        features: Union[np.ndarray, scipy.sparse.spmatrix],
+        metric: str = 'sqeuclidean'
+    ):
+        check_kmer_distance_metric(metric)
+        self.metric = metric
+        squared_norms = row_squared_norms(features)
+        if metric == 'cosine':
+            inverse_norms = np.divide(
+                1, np.sqrt(squared_norms),
+                out=np.zeros_like(squared_norms), where=squared_norms > 0
+            )
+            features = (
+                scipy.sparse.diags(inverse_norms) @ features if scipy.sparse.issparse(features)
+                else features * inverse_norms[:, None]
+            )
+        self.features = dense_rows(
+            features, 0, features.shape[0],
+            dtype=np.float64 if metric == 'cosine' else np.float32
+        )
+        self.squared_norms = squared_norms
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (self.features.shape[0], self.features.shape[0])
+
+    def __len__(self):
+        return self.features.shape[0]
+
+    def get_row(self, row: int) -> np.ndarray:
+        gram = (self.features @ self.features[row]).astype(np.float64)
+        if self.metric == 'cosine':
+            values = np.maximum(1 - gram, 0)
+        else:
+            values = np.maximum(self.squared_norms + self.squared_norms[row] - 2 * gram, 0)
+            if self.metric == 'euclidean':
+                np.sqrt(values, out=values)
+            else:
+                np.rint(values, out=values)
+        values[row] = 0
+        return values.astype(kmer_distance_dtypes[self.metric])
+
+def seqs_kmer_distance_matrix(
+    seqs: list[SeqRecord],
+    k: int = 4,
+    metric: str = 'sqeuclidean',
+    alphabet: str = 'ACGT'
+) -> KmerDistanceMatrix:
+    return KmerDistanceMatrix(
+        seqs_kmer_count_matrix(seqs, k=k, alphabet=alphabet),
+        metric=metric
+    )
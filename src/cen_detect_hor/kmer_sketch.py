@@ -0,0 +1,164 @@
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+from scipy.spatial.distance import cdist
+from .shared_memory_utils import attach_memmap, shared_temp_filename
+
+KMER_HASH_BASE = 1000003
+KMER_HASH_MIX = 0x9E3779B97F4A7C15
+
+@dataclass
+class SketchParams:
+    k: int = 5
+    num_buckets: int = 1024
+
+@dataclass
+class SketchSummary:
+    center: np.ndarray
+    radius: float
+    min_length: int
+    max_length: int
+
+@dataclass
+class PruningStats:
+    pruned_tiles: int = 0
+    total_tiles: int = 0
+    pruned_pairs: int = 0
+    total_pairs: int = 0
+
+    def add(self, other: Optional['PruningStats']):
+        if other is None:
+            return
+        self.pruned_tiles += other.pruned_tiles
+        self.total_tiles += other.total_tiles
+        self.pruned_pairs += other.pruned_pairs
+        self.total_pairs += other.total_pairs
+
+    def __str__(self):
+        return (
+            f"pruned tiles: {self.pruned_tiles} out of {self.total_tiles}, " +
+            f"pruned pairs: {self.pruned_pairs} out of {self.total_pairs}"
+        )
+
+@dataclass
+class SharedSketches:
+    filename: str
+    chunk_size: int
+
+    def get_chunk(self, index: int) -> np.ndarray:
+        return attach_memmap(self.filename)[index * self.chunk_size:(index + 1) * self.chunk_size]
+
+def sketch_counts_dtype(max_length: int) -> np.dtype:
+    return np.uint16 if max_length <= np.iinfo(np.uint16).max else np.uint32
+
+def kmer_count_sketches(
+    strings: list[str],
+    sketch_params: SketchParams,
+    dtype: np.dtype = None
+) -> np.ndarray:
+    k = sketch_params.k
+    num_buckets = sketch_params.num_buckets
+    encoded_strings = [string.encode() for string in strings]
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(encoded) for encoded in encoded_strings], out=offsets[1:])
+    if dtype is None:
+        dtype = sketch_counts_dtype(int(np.diff(offsets).max(initial=0)))
+    codes = np.frombuffer(b''.join(encoded_strings), dtype=np.uint8).astype(np.uint64)
+    if len(codes) < k:
+        return np.zeros((len(strings), num_buckets), dtype=dtype)
+    powers = np.uint64(KMER_HASH_BASE) ** np.arange(k - 1, -1, -1, dtype=np.uint64)
+    kmer_hashes = (
+        (np.lib.stride_tricks.sliding_window_view(codes, k) @ powers) *
+        np.uint64(KMER_HASH_MIX)
+    ) >> np.uint64(32)
+    window_starts = np.arange(len(kmer_hashes), dtype=np.int64)
+    window_strings = np.searchsorted(offsets, window_starts, side='right') - 1
+    valid_windows = window_starts + k <= offsets[window_strings + 1]
+    return np.bincount(
+        window_strings[valid_windows] * num_buckets +
+        (kmer_hashes[valid_windows] % np.uint64(num_buckets)).astype(np.int64),
+        minlength=len(strings) * num_buckets
+    ).reshape(len(strings), num_buckets).astype(dtype)
+
+def create_shared_sketches(
+    strings: list[str],
+    chunk_size: int,
+    sketch_params: SketchParams
+) -> tuple[SharedSketches, list['SketchSummary']]:
+    shared_sketches = SharedSketches(filename=shared_temp_filename(), chunk_size=chunk_size)
+    dtype = sketch_counts_dtype(max([len(string) for string in strings], default=0))
+    sketches = np.lib.format.open_memmap(
+        shared_sketches.filename, mode='w+', dtype=dtype,
+        shape=(len(strings), sketch_params.num_buckets)
+    )
+    chunk_summaries = []
+    for offset in range(0, len(strings), chunk_size):
+        chunk_strings = strings[offset:offset + chunk_size]
+        chunk_sketches = kmer_count_sketches(chunk_strings, sketch_params, dtype=dtype)
+        sketches[offset:offset + chunk_size] = chunk_sketches
+        chunk_summaries.append(sketch_summary(chunk_sketches, string_lengths_array(chunk_strings)))
+    sketches.flush()
+    return shared_sketches, chunk_summaries
+
+def string_lengths_array(strings: list[str]) -> np.ndarray:
+    return np.array([len(string) for string in strings], dtype=np.int64)
+
+def pair_lower_bounds(
+    row_sketches: np.ndarray,
+    col_sketches: np.ndarray,
+    row_lengths: np.ndarray,
+    col_lengths: np.ndarray,
+    sketch_params: SketchParams
+) -> np.ndarray:
+    kmer_bounds = np.ceil(
+        cdist(row_sketches, col_sketches, metric='cityblock') / (2 * sketch_params.k)
+    ).astype(np.int64)
+    length_bounds = np.abs(row_lengths[:, None] - col_lengths[None, :])
+    return np.maximum(kmer_bounds, length_bounds)
+
+def skipped_pairs_mask(
+    row_strings: list[str],
+    col_strings: list[str],
+    sketch_params: SketchParams,
+    max_distance: int,
+    only_triu: bool = False,
+    row_sketches: Optional[np.ndarray] = None,
+    col_sketches: Optional[np.ndarray] = None
+) -> np.ndarray:
+    if row_sketches is None:
+        row_sketches = kmer_count_sketches(row_strings, sketch_params)
+    if col_sketches is None:
+        col_sketches = kmer_count_sketches(col_strings, sketch_params)
+    skipped_pairs = pair_lower_bounds(
+        row_sketches,
+        col_sketches,
+        string_lengths_array(row_strings),
+        string_lengths_array(col_strings),
+        sketch_params
+    ) >= max_distance
+    return np.triu(skipped_pairs, k=1) if only_triu else skipped_pairs
+
+def sketch_summary(sketches: np.ndarray, lengths: np.ndarray) -> SketchSummary:
+    sketches = sketches.astype(np.float64)
+    center = np.median(sketches, axis=0)
+    return SketchSummary(
+        center=center,
+        radius=float(np.abs(sketches - center).sum(axis=1).max(initial=0)),
+        min_length=int(lengths.min(initial=0)),
+        max_length=int(lengths.max(initial=0))
+    )
+
+def tile_lower_bound(
+    row_summary: SketchSummary,
+    col_summary: SketchSummary,
+    sketch_params: SketchParams
+) -> int:
+    kmer_bound = (
+        np.abs(row_summary.center - col_summary.center).sum() -
+        row_summary.radius - col_summary.radius
+    ) / (2 * sketch_params.k)
+    length_bound = max(
+        col_summary.min_length - row_summary.max_length,
+        row_summary.min_length - col_summary.max_length
+    )
+    return max(0, int(np.ceil(kmer_bound)), length_bound)
@@ -1,18 +1,184 @@
 import math
 import numpy as np
 
-def matrix_to_triu(matrix: np.ndarray) -> np.ndarray:
-    return matrix[np.triu_indices_from(matrix, k=1)]
+def triu_size(matrix_size: int) -> int:
+    return matrix_size * (matrix_size - 1) // 2
 
-def triu_to_matrix(triu: np.ndarray) -> np.ndarray:
-    matrix_size = int((math.sqrt(1 + 8 *len(triu)) + 1) / 2)
-    matrix = np.zeros((matrix_size, matrix_size), dtype=triu.dtype)
-    matrix[np.triu_indices_from(matrix, k=1)] = triu
-    return matrix + matrix.T
+def triu_to_matrix_size(triu_len: int) -> int:
+    return (math.isqrt(1 + 8 * triu_len) + 1) // 2
+
+def matrix_size(matrix: np.ndarray) -> int:
+    return (
+        triu_to_matrix_size(len(matrix)) if matrix.ndim == 1
+        else matrix.shape[0]
+    )
+
+def triu_index(matrix_size: int, row: int, col: int) -> int:
+    return row * matrix_size - row * (row + 1) // 2 + col - row - 1
+
+def set_triu_block(
+    triu: np.ndarray,
+    matrix_size: int,
+    row_offset: int,
+    col_offset: int,
+    block: np.ndarray
+):
+    num_rows, num_cols = block.shape
+    col_end = col_offset + num_cols
+    for row in range(row_offset, min(row_offset + num_rows, col_end - 1)):
+        col_start = max(col_offset, row + 1)
+        triu_start = triu_index(matrix_size, row, col_start)
+        triu[triu_start:triu_start + col_end - col_start] = (
+            block[row - row_offset, col_start - col_offset:]
+        )
+
+def matrix_to_triu(matrix: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    if out is None:
+        out = np.empty(triu_size(matrix.shape[0]), dtype=matrix.dtype)
+    set_triu_block(out, matrix.shape[0], row_offset=0, col_offset=0, block=matrix)
+    return out
+
+def triu_to_matrix(triu: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    matrix_size = triu_to_matrix_size(len(triu))
+    if out is None:
+        out = np.empty((matrix_size, matrix_size), dtype=triu.dtype)
+    triu_start = 0
+    for row in range(matrix_size):
+        triu_end = triu_start + matrix_size - row - 1
+        out[row, row] = 0
+        out[row, row + 1:] = triu[triu_start:triu_end]
+        out[row + 1:, row] = triu[triu_start:triu_end]
+        triu_start = triu_end
+    return out
+
+def extend_matrix(
+    matrix: np.ndarray,
+    cross_matrix: np.ndarray,
+    new_matrix: np.ndarray,
+    out: np.ndarray = None
+) -> np.ndarray:
+    num_old, num_new = cross_matrix.shape
+    num_items = num_old + num_new
+    if out is None:
+        out = np.empty(
+            (triu_size(num_items),) if matrix.ndim == 1 else (num_items, num_items),
+            dtype=np.result_type(matrix, cross_matrix, new_matrix)
+        )
+    if matrix.ndim == 1:
+        triu_start = 0
+        out_start = 0
+        for row in range(num_old):
+            row_len = num_old - row - 1
+            out[out_start:out_start + row_len] = matrix[triu_start:triu_start + row_len]
+            out[out_start + row_len:out_start + row_len + num_new] = cross_matrix[row]
+            triu_start += row_len
+            out_start += row_len + num_new
+        out[out_start:] = new_matrix
+    else:
+        out[:num_old, :num_old] = matrix
+        out[:num_old, num_old:] = cross_matrix
+        out[num_old:, :num_old] = cross_matrix.T
+        out[num_old:, num_old:] = new_matrix
+    return out
+
+def open_matrix_memmap(
+    filename: str,
+    matrix_size: int,
+    dtype: np.dtype,
+    layout: str = 'square'
+) -> np.memmap:
+    return np.lib.format.open_memmap(
+        filename,
+        mode='w+',
+        dtype=dtype,
+        shape=(
+            (triu_size(matrix_size),) if layout == 'condensed'
+            else (matrix_size, matrix_size)
+        )
+    )
 
 def save_matrix_as_triu(matrix: np.ndarray, filename: str):
     with open(filename, 'wb') as f:
-        np.save(f, matrix_to_triu(matrix))
+        np.save(f, matrix if matrix.ndim == 1 else matrix_to_triu(matrix))
     
 def load_matrix_from_triu(filename: str) -> np.ndarray:
     return triu_to_matrix(np.load(filename))
+
+def open_triu_memmap(filename: str, mode: str = 'r') -> np.memmap:
+    triu = np.load(filename, mmap_mode=mode)
+    if triu.ndim != 1:
+        raise Exception(f"{filename} does not contain a condensed distance matrix")
+    return triu
+
+def matrix_row(matrix: np.ndarray, matrix_size: int, row: int) -> np.ndarray:
+    if matrix.ndim == 2:
+        return np.asarray(matrix[row])
+    values = np.empty(matrix_size, dtype=matrix.dtype)
+    values[:row] = matrix[triu_index(matrix_size, np.arange(row), row)]
+    values[row] = 0
+    triu_start = triu_index(matrix_size, row, row + 1)
+    values[row + 1:] = matrix[triu_start:triu_start + matrix_size - row - 1]
+    return values
+
+def triu_lookup(
+    triu: np.ndarray,
+    matrix_size: int,
+    rows: np.ndarray,
+    cols: np.ndarray
+) -> np.ndarray:
+    rows, cols = np.broadcast_arrays(np.asarray(rows), np.asarray(cols))
+    upper_rows = np.minimum(rows, cols)
+    upper_cols = np.maximum(rows, cols)
+    off_diagonal = upper_rows != upper_cols
+    values = np.zeros(rows.shape, dtype=triu.dtype)
+    values[off_diagonal] = triu[triu_index(
+        matrix_size, upper_rows[off_diagonal], upper_cols[off_diagonal]
+    )]
+    return values
+
+class DeduplicatedMatrix:
+    unique_matrix: np.ndarray
+    item_to_unique: np.ndarray
+    num_unique: int
+
+    def __init__(self, unique_matrix: np.ndarray, item_to_unique: np.ndarray):
+        self.unique_matrix = unique_matrix
+        self.item_to_unique = np.asarray(item_to_unique, dtype=np.int64)
+        self.num_unique = matrix_size(unique_matrix)
+
+    @property
+    def num_items(self) -> int:
+        return len(self.item_to_unique)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (self.num_items, self.num_items)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.unique_matrix.dtype
+
+    def __len__(self):
+        return self.num_items
+
+    def __getitem__(self, key) -> np.ndarray:
+        row_key, col_key = key if isinstance(key, tuple) else (key, slice(None))
+        rows = self.item_to_unique[row_key]
+        cols = self.item_to_unique[col_key]
+        if np.ndim(rows) > 0 and np.ndim(cols) > 0:
+            rows, cols = np.ix_(rows, cols)
+        if self.unique_matrix.ndim == 1:
+            return triu_lookup(self.unique_matrix, self.num_unique, rows, cols)
+        return self.unique_matrix[rows, cols]
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        matrix = self[:, :]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+def deduplicate_items(items: list) -> tuple[list[int], list]:
+    unique_indices = {}
+    item_to_unique = [
+        unique_indices.setdefault(item, len(unique_indices))
+        for item in items
+    ]
+    return item_to_unique, list(unique_indices.keys())
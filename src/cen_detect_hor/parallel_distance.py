@@ -1,11 +1,28 @@
 from functools import partial
+import hashlib
+import io
+import json
 import multiprocessing
+import multiprocessing.util
 import math
+import lzma
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import zlib
 import numpy as np
-import editdistance
+import scipy.sparse
 from Bio.SeqRecord import SeqRecord
 from multiprocessing import Pool
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from typing import Optional, Union
+from .matrix_utils import DeduplicatedMatrix, deduplicate_items, extend_matrix, open_matrix_memmap, set_triu_block, triu_size
+from .shared_memory_utils import SharedStrings, SharedStringsSlice, attach_memmap, create_shared_strings, release_shared_memory, shared_temp_filename
+from .kmer_sketch import PruningStats, SharedSketches, SketchParams, SketchSummary, create_shared_sketches, skipped_pairs_mask, tile_lower_bound
+from .clustering_to_phylogeny import LinkageClustering, spanning_edges_to_clustering
+from .distance_kernels import bit_parallel_cross_distance_matrix, bounded_edit_distance, hamming_cross_distance_matrix
 
 num_bytes_to_max_value_map = [
     2**(num_bytes * 8) - 1 for num_bytes in range(1, 33)
@@ -18,6 +35,11 @@ def num_bytes_to_max_value(num_bytes: int) -> int:
 def limited(x: int, num_bytes: int) -> int:
     return min(x, num_bytes_to_max_value(num_bytes))
 
+def limited_array(values: np.ndarray, num_bytes: int) -> np.ndarray:
+    return np.minimum(values, num_bytes_to_max_value(num_bytes)).astype(
+        num_bytes_to_uint_dtype(num_bytes)
+    )
+
 def num_bytes_to_uint_dtype(num_bytes: int) -> np.dtype:
     if num_bytes == 1:
         return np.uint8
@@ -33,18 +55,53 @@ def num_bytes_to_uint_dtype(num_bytes: int) -> np.dtype:
         return np.uint256
     raise Exception('Unsupported num of bytes requested for integer')
 
+distance_kernels = ['editdistance', 'bit_parallel']
+
+distance_metrics = ['edit', 'hamming']
+
+def check_distance_kernel(kernel: str):
+    if kernel not in distance_kernels:
+        raise Exception(f'Unsupported distance kernel: {kernel}')
+
+def check_distance_metric(metric: str):
+    if metric not in distance_metrics:
+        raise Exception(f'Unsupported distance metric: {metric}')
+
+def distance_cap(num_bytes: int, max_distance: Optional[int] = None) -> int:
+    return (
+        num_bytes_to_max_value(num_bytes) if max_distance is None
+        else min(max_distance, num_bytes_to_max_value(num_bytes))
+    )
+
 def build_string_distance_triu(
     strings: list[str],
-    num_bytes_for_each_distance: int = 1
+    num_bytes_for_each_distance: int = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    skip_pairs: Optional[np.ndarray] = None
 ) -> np.ndarray:
+    check_distance_kernel(kernel)
+    check_distance_metric(metric)
+    cap = distance_cap(num_bytes_for_each_distance, max_distance)
+    if metric == 'hamming':
+        return limited_array(
+            hamming_cross_distance_matrix(strings, strings, only_triu=True, max_distance=cap),
+            num_bytes=num_bytes_for_each_distance
+        )
+    if kernel == 'bit_parallel':
+        return limited_array(
+            bit_parallel_cross_distance_matrix(
+                strings, strings, only_triu=True, max_distance=cap, skip_pairs=skip_pairs
+            ),
+            num_bytes=num_bytes_for_each_distance
+        )
     seq_triu = np.array(
         [
             (
                 0 if j <= i
-                else limited(
-                    editdistance.eval(seq_i, strings[j]),
-                    num_bytes=num_bytes_for_each_distance
-                )
+                else cap if skip_pairs is not None and skip_pairs[i, j]
+                else bounded_edit_distance(seq_i, strings[j], max_distance=cap)
             )
             for i, seq_i in enumerate(strings)
             for j in range(len(strings))
@@ -66,16 +123,35 @@ def build_string_distance_matrix(
 def build_string_cross_distance_matrix(
     row_strings: list[str],
     col_strings: list[str],
-    num_bytes_for_each_distance: int = 1
+    num_bytes_for_each_distance: int = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    skip_pairs: Optional[np.ndarray] = None
 ) -> np.ndarray:
+    check_distance_kernel(kernel)
+    check_distance_metric(metric)
+    cap = distance_cap(num_bytes_for_each_distance, max_distance)
+    if metric == 'hamming':
+        return limited_array(
+            hamming_cross_distance_matrix(row_strings, col_strings, max_distance=cap),
+            num_bytes=num_bytes_for_each_distance
+        )
+    if kernel == 'bit_parallel':
+        return limited_array(
+            bit_parallel_cross_distance_matrix(
+                row_strings, col_strings, max_distance=cap, skip_pairs=skip_pairs
+            ),
+            num_bytes=num_bytes_for_each_distance
+        )
     dist_matrix = np.array(
         [
-            limited(
-                editdistance.eval(row_string, col_string),
-                num_bytes=num_bytes_for_each_distance
+            (
+                cap if skip_pairs is not None and skip_pairs[i, j]
+                else bounded_edit_distance(row_string, col_string, max_distance=cap)
             )
-            for row_string in row_strings
-            for col_string in col_strings
+            for i, row_string in enumerate(row_strings)
+            for j, col_string in enumerate(col_strings)
         ],
         dtype=num_bytes_to_uint_dtype(num_bytes_for_each_distance)
     )
@@ -97,16 +173,59 @@ class ChunkIndex:
     row: int
     col: int
 
+def string_lengths(strings: Union[list[str], SharedStringsSlice]) -> np.ndarray:
+    if isinstance(strings, SharedStringsSlice):
+        return strings.get_lengths()
+    return np.array([len(string) for string in strings], dtype=np.int64)
+
+def resolve_strings(strings: Union[list[str], SharedStringsSlice]) -> list[str]:
+    if isinstance(strings, SharedStringsSlice):
+        return strings.to_list()
+    return strings
+
+def hash_strings(hasher, strings: list[str]):
+    hasher.update(len(strings).to_bytes(8, 'little'))
+    for string in strings:
+        encoded_string = string.encode()
+        hasher.update(len(encoded_string).to_bytes(8, 'little'))
+        hasher.update(encoded_string)
+
+def chunk_content_key(
+    chunk_type: str,
+    strings_lists: list[list[str]],
+    distance_params: dict
+) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps([chunk_type, distance_params], sort_keys=True).encode())
+    for strings in strings_lists:
+        hash_strings(hasher, resolve_strings(strings))
+    return hasher.hexdigest()
+
 class ChunkParams:
     def get_index(self) -> ChunkIndex:
         pass
 
+    def get_cost(self) -> int:
+        return 0
+
+    def get_shape(self) -> tuple[int, int]:
+        pass
+
+    def get_key(self, distance_params: dict) -> str:
+        pass
+
+    def resolve_strings(self) -> 'ChunkParams':
+        return self
+
+    def results_from_data(self, data: np.ndarray) -> 'ChunkResults':
+        pass
+
 @dataclass
 class ChunkParamsInternal(ChunkParams):
     row_index: int
     col_index: int
-    row_strings: list[str]
-    col_strings: list[str]
+    row_strings: Union[list[str], SharedStringsSlice]
+    col_strings: Union[list[str], SharedStringsSlice]
 
     def __str__(self):
         return f"[{self.row_index}:{self.col_index}]({len(self.row_strings)},{len(self.col_strings)})"
@@ -114,11 +233,36 @@ class ChunkParamsInternal(ChunkParams):
     def get_index(self):
         return ChunkIndex(self.row_index, self.col_index)
 
+    def get_cost(self) -> int:
+        return int(string_lengths(self.row_strings).sum()) * int(string_lengths(self.col_strings).sum())
+
+    def get_shape(self) -> tuple[int, int]:
+        return (len(self.row_strings), len(self.col_strings))
+
+    def get_key(self, distance_params: dict) -> str:
+        return chunk_content_key(
+            'internal', [self.row_strings, self.col_strings], distance_params
+        )
+
+    def resolve_strings(self) -> 'ChunkParamsInternal':
+        return replace(
+            self,
+            row_strings=resolve_strings(self.row_strings),
+            col_strings=resolve_strings(self.col_strings)
+        )
+
+    def results_from_data(self, data: np.ndarray) -> 'ChunkResultsInternal':
+        return ChunkResultsInternal(
+            row_index=self.row_index,
+            col_index=self.col_index,
+            dist_matrix=data
+        )
+
 
 @dataclass
 class ChunkParamsDiagonal(ChunkParams):
     index: int
-    strings: list[str]
+    strings: Union[list[str], SharedStringsSlice]
 
     def __str__(self):
         return f"[{self.index}:{self.index}]({len(self.strings)},{len(self.strings)})"
@@ -126,8 +270,27 @@ class ChunkParamsDiagonal(ChunkParams):
     def get_index(self):
         return ChunkIndex(self.index, self.index)
 
+    def get_cost(self) -> int:
+        lengths = string_lengths(self.strings)
+        return (int(lengths.sum()) ** 2 - int((lengths ** 2).sum())) // 2
+
+    def get_shape(self) -> tuple[int, int]:
+        return (len(self.strings), len(self.strings))
+
+    def get_key(self, distance_params: dict) -> str:
+        return chunk_content_key('diagonal', [self.strings], distance_params)
+
+    def resolve_strings(self) -> 'ChunkParamsDiagonal':
+        return replace(self, strings=resolve_strings(self.strings))
+
+    def results_from_data(self, data: np.ndarray) -> 'ChunkResultsDiagonal':
+        return ChunkResultsDiagonal(index=self.index, dist_triu=data)
+
 class ChunkResults:
 
+    def get_index(self) -> ChunkIndex:
+        pass
+
     def get_data(self) -> np.ndarray:
         pass
 
@@ -138,6 +301,9 @@ class ChunkResultsInternal(ChunkResults):
     col_index: int
     dist_matrix: np.ndarray
 
+    def get_index(self):
+        return ChunkIndex(self.row_index, self.col_index)
+
     def get_data(self) -> np.ndarray:
         return self.dist_matrix
 
@@ -146,6 +312,9 @@ class ChunkResultsDiagonal(ChunkResults):
     index: int
     dist_triu: np.ndarray
 
+    def get_index(self):
+        return ChunkIndex(self.index, self.index)
+
     def get_data(self) -> np.ndarray:
         return self.dist_triu
 
@@ -158,60 +327,718 @@ class JobParams:
     def __str__(self):
         return "(" + ",".join([str(cp) for cp in self.chunk_params]) + ")"
 
+    def get_cost(self) -> int:
+        return sum([cp.get_cost() for cp in self.chunk_params])
+
 
 @dataclass
 class JobResult:
     chunk_results: list[ChunkResults]
+    pruning_stats: Optional[PruningStats] = None
+
+
+@dataclass
+class GraphJobResult:
+    chunk_pairs: list[tuple[np.ndarray, np.ndarray, np.ndarray]]
+    pruning_stats: Optional[PruningStats] = None
+
+
+@dataclass
+class JobStatus:
+    chunk_indices: list[ChunkIndex]
+    pruning_stats: Optional[PruningStats] = None
+
+
+@dataclass
+class SharedResultMatrix:
+    filename: str
+    chunk_size: int
+    num_strings: int
+    cross: bool = False
 
 
 class ChunkStore:
-    def get(self, chunk_params: ChunkParams) -> ChunkResults:
+    writes_from_parent: bool = False
+
+    def get(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None
+    ) -> ChunkResults:
         return None
 
-    def set(self, chunk_params: ChunkParams, chunk_results: ChunkResults):
+    def get_mapped(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None
+    ) -> ChunkResults:
+        return self.get(chunk_params, chunk_key=chunk_key)
+
+    def set(
+        self,
+        chunk_params: ChunkParams,
+        chunk_results: ChunkResults,
+        chunk_key: Optional[str] = None
+    ):
+        pass
+
+    def flush(self):
         pass
 
 dummy_chunk_store = ChunkStore()
 
-class FileSystemChunkStore:
+def data_checksum(data: np.ndarray) -> str:
+    return hashlib.sha256(np.ascontiguousarray(data).data).hexdigest()
+
+def fsync_directory(dirname: str):
+    try:
+        dir_descriptor = os.open(dirname, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_descriptor)
+
+def write_file_atomically(filename: str, write_content):
+    dirname = os.path.dirname(os.path.abspath(filename))
+    file_descriptor, temp_filename = tempfile.mkstemp(
+        dir=dirname,
+        prefix='.' + os.path.basename(filename) + '.',
+        suffix='.tmp'
+    )
+    try:
+        with os.fdopen(file_descriptor, 'wb') as temp_file:
+            write_content(temp_file)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        os.replace(temp_filename, filename)
+    except BaseException:
+        try:
+            os.remove(temp_filename)
+        except OSError:
+            pass
+        raise
+    fsync_directory(dirname)
+
+def append_line(filename: str, line: str):
+    file_descriptor = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(file_descriptor, (line + '\n').encode())
+    finally:
+        os.close(file_descriptor)
+
+class FileSystemChunkStore(ChunkStore):
     filename_template: str
+    manifest_filename: Optional[str]
+    verify_checksums: bool
+    file_suffix: str = '.npy'
     
-    def __init__(self, filename_template) -> None:
+    def __init__(
+        self,
+        filename_template,
+        manifest_filename: Optional[str] = None,
+        verify_checksums: bool = True
+    ) -> None:
         self.filename_template = filename_template
+        self.verify_checksums = verify_checksums
+        self.manifest_filename = (
+            manifest_filename if manifest_filename is not None
+            else os.path.join(os.path.dirname(filename_template), 'manifest.jsonl')
+        )
+
+    def get_filename(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None
+    ) -> str:
+        filename = self.filename_template.format_map({
+            **vars(chunk_params.get_index()),
+            'key': chunk_key
+        })
+        if chunk_key is not None and '{key}' not in self.filename_template:
+            filename += '_' + chunk_key
+        return filename
     
-    def get(self, chunk_params: ChunkParams) -> ChunkResults:
-        filename = self.filename_template.format_map(vars(chunk_params.get_index()))
+    def load_data(self, filename: str, mmap_mode: Optional[str] = None) -> np.ndarray:
+        return np.load(filename, mmap_mode=mmap_mode)
+
+    def save_data(self, data_file, data: np.ndarray):
+        np.save(data_file, data)
+
+    def get(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None,
+        mmap_mode: Optional[str] = None
+    ) -> ChunkResults:
+        filename = self.get_filename(chunk_params, chunk_key) + self.file_suffix
         try:
-            cache_chunk_results_data = np.load(filename + '.npy')
-            if isinstance(chunk_params, ChunkParamsDiagonal):
-                return ChunkResultsDiagonal(
-                    index=chunk_params.index,
-                    dist_triu=cache_chunk_results_data
-                )
-            if isinstance(chunk_params, ChunkParamsInternal):
-                return ChunkResultsInternal(
-                    row_index=chunk_params.row_index,
-                    col_index=chunk_params.col_index,
-                    dist_matrix=cache_chunk_results_data
+            cache_chunk_results_data = self.load_data(filename, mmap_mode=mmap_mode)
+            if cache_chunk_results_data.shape != chunk_params.get_shape():
+                return None
+            if self.verify_checksums:
+                with open(filename + '.sha256') as checksum_file:
+                    expected_checksum = checksum_file.read().strip()
+                if data_checksum(cache_chunk_results_data) != expected_checksum:
+                    print(f'Discarding corrupted chunk {filename}')
+                    return None
+        except (IOError, ValueError, EOFError, zlib.error, lzma.LZMAError):
+            return None
+        return chunk_params.results_from_data(cache_chunk_results_data)
+
+    def get_mapped(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None
+    ) -> ChunkResults:
+        return self.get(chunk_params, chunk_key=chunk_key, mmap_mode='r')
+
+    def set(
+        self,
+        chunk_params: ChunkParams,
+        chunk_results: ChunkResults,
+        chunk_key: Optional[str] = None
+    ):
+        filename = self.get_filename(chunk_params, chunk_key) + self.file_suffix
+        data = np.ascontiguousarray(chunk_results.get_data())
+        write_file_atomically(
+            filename + '.sha256',
+            lambda checksum_file: checksum_file.write((data_checksum(data) + '\n').encode())
+        )
+        write_file_atomically(filename, lambda data_file: self.save_data(data_file, data))
+        if chunk_key is not None:
+            append_line(self.manifest_filename, json.dumps({
+                'key': chunk_key,
+                'filename': filename,
+                'row': chunk_params.get_index().row,
+                'col': chunk_params.get_index().col,
+                'shape': list(data.shape),
+                'dtype': str(data.dtype)
+            }))
+
+
+compressions = ['zlib', 'lzma']
+
+def check_compression(compression: str):
+    if compression not in compressions:
+        raise Exception(f'Unknown compression {compression}, expected one of {compressions}')
+
+def create_compressor(compression: str, level: int):
+    if compression == 'zlib':
+        return zlib.compressobj(level)
+    return lzma.LZMACompressor(preset=level)
+
+def iter_decompressed_blocks(data_file, compression: str, block_size: int):
+    if compression == 'zlib':
+        decompressor = zlib.decompressobj()
+        while not decompressor.eof:
+            data = decompressor.unconsumed_tail
+            if len(data) == 0:
+                data = data_file.read(block_size)
+                if len(data) == 0:
+                    return
+            yield decompressor.decompress(data, block_size)
+    else:
+        decompressor = lzma.LZMADecompressor()
+        while not decompressor.eof:
+            data = b''
+            if decompressor.needs_input:
+                data = data_file.read(block_size)
+                if len(data) == 0:
+                    return
+            yield decompressor.decompress(data, block_size)
+
+def read_compressed_array(
+    data_file,
+    shape: tuple,
+    dtype: np.dtype,
+    compression: str,
+    block_size: int,
+    fortran_order: bool = False
+) -> np.ndarray:
+    data = np.empty(shape, dtype=dtype, order='F' if fortran_order else 'C')
+    data_bytes = data.reshape(-1, order='A').view(np.uint8)
+    position = 0
+    for block in iter_decompressed_blocks(data_file, compression, block_size):
+        if position + len(block) > len(data_bytes):
+            raise ValueError('Compressed chunk has more data than its shape allows')
+        data_bytes[position:position + len(block)] = np.frombuffer(block, dtype=np.uint8)
+        position += len(block)
+    if position != len(data_bytes):
+        raise ValueError('Compressed chunk is truncated')
+    return data
+
+def write_compressed_array(
+    data_file,
+    data: np.ndarray,
+    compression: str,
+    level: int,
+    block_size: int
+):
+    compressor = create_compressor(compression, level)
+    data_bytes = np.ascontiguousarray(data).reshape(-1).view(np.uint8)
+    for start in range(0, len(data_bytes), block_size):
+        data_file.write(compressor.compress(data_bytes[start:start + block_size]))
+    data_file.write(compressor.flush())
+
+class CompressedFileSystemChunkStore(FileSystemChunkStore):
+    compression: str
+    level: int
+    block_size: int
+
+    def __init__(
+        self,
+        filename_template,
+        manifest_filename: Optional[str] = None,
+        verify_checksums: bool = True,
+        compression: str = 'zlib',
+        level: int = 6,
+        block_size: int = 2**20
+    ) -> None:
+        check_compression(compression)
+        super().__init__(
+            filename_template,
+            manifest_filename=manifest_filename,
+            verify_checksums=verify_checksums
+        )
+        self.compression = compression
+        self.level = level
+        self.block_size = block_size
+        self.file_suffix = '.npy.' + compression
+
+    def load_data(self, filename: str, mmap_mode: Optional[str] = None) -> np.ndarray:
+        with open(filename, 'rb') as data_file:
+            version = np.lib.format.read_magic(data_file)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(data_file)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(data_file)
+            return read_compressed_array(
+                data_file, shape, dtype,
+                compression=self.compression,
+                block_size=self.block_size,
+                fortran_order=fortran_order
+            )
+
+    def save_data(self, data_file, data: np.ndarray):
+        np.lib.format.write_array_header_1_0(
+            data_file, np.lib.format.header_data_from_array_1_0(data)
+        )
+        write_compressed_array(
+            data_file, data,
+            compression=self.compression,
+            level=self.level,
+            block_size=self.block_size
+        )
+
+class SQLiteConnection:
+    filename: str
+
+    def __init__(self, filename: str, timeout: float) -> None:
+        self.filename = filename
+        self.pid = os.getpid()
+        self.pending_rows = []
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(filename, timeout=timeout, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS chunks ('
+                'key TEXT PRIMARY KEY, row INTEGER, col INTEGER, '
+                'shape TEXT, dtype TEXT, compression TEXT, checksum TEXT, data BLOB)'
+            )
+        multiprocessing.util.Finalize(None, self.close, exitpriority=10)
+
+    def flush(self):
+        with self.lock:
+            if len(self.pending_rows) == 0 or self.connection is None:
+                return
+            with self.connection:
+                self.connection.executemany(
+                    'INSERT OR REPLACE INTO chunks '
+                    '(key, row, col, shape, dtype, compression, checksum, data) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    self.pending_rows
                 )
-        except IOError:
+            self.pending_rows = []
+
+    def close(self):
+        with self.lock:
+            if self.pid != os.getpid() or self.connection is None:
+                return
+            try:
+                self.flush()
+            finally:
+                self.connection.close()
+                self.connection = None
+                sqlite_connections.pop((self.pid, self.filename), None)
+
+sqlite_connections: dict[tuple[int, str], SQLiteConnection] = {}
+
+class SQLiteChunkStore(ChunkStore):
+    writes_from_parent: bool = True
+    filename: str
+    compression: Optional[str]
+    level: int
+    batch_size: int
+    timeout: float
+    verify_checksums: bool
+
+    def __init__(
+        self,
+        filename: str,
+        compression: Optional[str] = None,
+        level: int = 6,
+        batch_size: int = 64,
+        timeout: float = 600.0,
+        verify_checksums: bool = True
+    ) -> None:
+        if compression is not None:
+            check_compression(compression)
+        self.filename = os.path.abspath(filename)
+        self.compression = compression
+        self.level = level
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.verify_checksums = verify_checksums
+
+    def get_connection(self, create: bool = True) -> Optional[SQLiteConnection]:
+        connection_key = (os.getpid(), self.filename)
+        connection = sqlite_connections.get(connection_key)
+        if connection is None and create:
+            connection = SQLiteConnection(self.filename, self.timeout)
+            sqlite_connections[connection_key] = connection
+        return connection
+
+    def get_key(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None
+    ) -> str:
+        if chunk_key is not None:
+            return chunk_key
+        index = chunk_params.get_index()
+        return f'{index.row}_{index.col}'
+
+    def get(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None
+    ) -> ChunkResults:
+        key = self.get_key(chunk_params, chunk_key)
+        try:
+            connection = self.get_connection()
+            with connection.lock:
+                for row in connection.pending_rows:
+                    if row[0] == key:
+                        return chunk_params.results_from_data(self.decode_row(row[3:]))
+                row = connection.connection.execute(
+                    'SELECT shape, dtype, compression, checksum, data FROM chunks WHERE key = ?',
+                    (key,)
+                ).fetchone()
+            if row is None:
+                return None
+            data = self.decode_row(row)
+        except (sqlite3.DatabaseError, ValueError, zlib.error, lzma.LZMAError):
+            return None
+        if data.shape != chunk_params.get_shape():
+            return None
+        if self.verify_checksums and data_checksum(data) != row[3]:
+            print(f'Discarding corrupted chunk {key} in {self.filename}')
+            return None
+        return chunk_params.results_from_data(data)
+
+    def decode_row(self, row: tuple) -> np.ndarray:
+        shape_json, dtype_name, compression, checksum, blob = row
+        shape = tuple(json.loads(shape_json))
+        if compression is None:
+            return np.frombuffer(blob, dtype=dtype_name).reshape(shape)
+        return read_compressed_array(
+            io.BytesIO(blob), shape, np.dtype(dtype_name),
+            compression=compression,
+            block_size=2**20
+        )
+
+    def set(
+        self,
+        chunk_params: ChunkParams,
+        chunk_results: ChunkResults,
+        chunk_key: Optional[str] = None
+    ):
+        data = np.ascontiguousarray(chunk_results.get_data())
+        if self.compression is None:
+            blob = data.tobytes()
+        else:
+            blob_file = io.BytesIO()
+            write_compressed_array(
+                blob_file, data,
+                compression=self.compression,
+                level=self.level,
+                block_size=2**20
+            )
+            blob = blob_file.getvalue()
+        index = chunk_params.get_index()
+        row = (
+            self.get_key(chunk_params, chunk_key), index.row, index.col,
+            json.dumps(list(data.shape)), data.dtype.name, self.compression,
+            data_checksum(data), sqlite3.Binary(blob)
+        )
+        connection = self.get_connection()
+        with connection.lock:
+            connection.pending_rows.append(row)
+            if len(connection.pending_rows) >= self.batch_size:
+                connection.flush()
+
+    def flush(self):
+        connection = self.get_connection(create=False)
+        if connection is not None:
+            connection.flush()
+
+    def close(self):
+        connection = self.get_connection(create=False)
+        if connection is not None:
+            connection.close()
+
+class ChunkWriter:
+    chunk_store: ChunkStore
+
+    def __init__(self, chunk_store: ChunkStore, max_queue_size: int) -> None:
+        self.chunk_store = chunk_store
+        self.pid = os.getpid()
+        self.error = None
+        self.pending_chunks = {}
+        self.pending_lock = threading.Lock()
+        self.write_queue = queue.Queue(maxsize=max_queue_size)
+        self.thread = threading.Thread(target=self.write_chunks, daemon=True)
+        self.thread.start()
+        multiprocessing.util.Finalize(None, self.close, exitpriority=10)
+
+    def write_chunks(self):
+        while True:
+            operation, pending_key, chunk_params, chunk_results, chunk_key = self.write_queue.get()
+            try:
+                if operation == 'set':
+                    self.chunk_store.set(chunk_params, chunk_results, chunk_key=chunk_key)
+                elif operation == 'flush':
+                    self.chunk_store.flush()
+            except BaseException as error:
+                self.error = error
+            finally:
+                if operation == 'set':
+                    with self.pending_lock:
+                        self.pending_chunks.pop(pending_key, None)
+                self.write_queue.task_done()
+            if operation == 'stop':
+                return
+
+    def check_error(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise Exception('Background chunk write failed') from error
+
+    def get_pending(self, pending_key) -> ChunkResults:
+        with self.pending_lock:
+            return self.pending_chunks.get(pending_key)
+
+    def put(
+        self,
+        pending_key,
+        chunk_params: ChunkParams,
+        chunk_results: ChunkResults,
+        chunk_key: Optional[str] = None
+    ):
+        self.check_error()
+        with self.pending_lock:
+            self.pending_chunks[pending_key] = chunk_results
+        self.write_queue.put(('set', pending_key, chunk_params, chunk_results, chunk_key))
+
+    def flush(self, wait: bool = False):
+        if self.thread.is_alive():
+            self.write_queue.put(('flush', None, None, None, None))
+            if wait:
+                self.write_queue.join()
+        self.check_error()
+
+    def close(self):
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.flush(wait=True)
+            self.write_queue.put(('stop', None, None, None, None))
+            self.thread.join()
+        self.check_error()
+
+chunk_writers: dict[str, ChunkWriter] = {}
+
+class WriteBehindChunkStore(ChunkStore):
+    chunk_store: ChunkStore
+    max_queue_size: int
+    writer_id: str
+
+    def __init__(self, chunk_store: ChunkStore, max_queue_size: int = 16) -> None:
+        self.chunk_store = chunk_store
+        self.max_queue_size = max_queue_size
+        self.writer_id = os.urandom(16).hex()
+
+    @property
+    def writes_from_parent(self) -> bool:
+        return self.chunk_store.writes_from_parent
+
+    def get_writer(self, create: bool = True) -> Optional[ChunkWriter]:
+        writer = chunk_writers.get(self.writer_id)
+        if writer is not None and writer.pid == os.getpid():
+            return writer
+        if not create:
             return None
+        writer = ChunkWriter(self.chunk_store, self.max_queue_size)
+        chunk_writers[self.writer_id] = writer
+        return writer
 
-    def set(self, chunk_params: ChunkParams, chunk_results: ChunkResults):
-        filename = self.filename_template.format_map(vars(chunk_params.get_index()))
-        np.save(filename, chunk_results.get_data())
+    def pending_key(self, chunk_params: ChunkParams, chunk_key: Optional[str] = None):
+        if chunk_key is not None:
+            return chunk_key
+        index = chunk_params.get_index()
+        return (index.row, index.col)
 
+    def get_pending(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None
+    ) -> ChunkResults:
+        writer = self.get_writer(create=False)
+        if writer is None:
+            return None
+        return writer.get_pending(self.pending_key(chunk_params, chunk_key))
+
+    def get(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None
+    ) -> ChunkResults:
+        pending_chunk_results = self.get_pending(chunk_params, chunk_key)
+        if pending_chunk_results is not None:
+            return pending_chunk_results
+        return self.chunk_store.get(chunk_params, chunk_key=chunk_key)
+
+    def get_mapped(
+        self,
+        chunk_params: ChunkParams,
+        chunk_key: Optional[str] = None
+    ) -> ChunkResults:
+        pending_chunk_results = self.get_pending(chunk_params, chunk_key)
+        if pending_chunk_results is not None:
+            return pending_chunk_results
+        return self.chunk_store.get_mapped(chunk_params, chunk_key=chunk_key)
+
+    def set(
+        self,
+        chunk_params: ChunkParams,
+        chunk_results: ChunkResults,
+        chunk_key: Optional[str] = None
+    ):
+        self.get_writer().put(
+            self.pending_key(chunk_params, chunk_key),
+            chunk_params, chunk_results, chunk_key
+        )
+
+    def flush(self):
+        writer = self.get_writer(create=False)
+        if writer is not None:
+            writer.flush(wait=True)
+
+    def close(self):
+        writer = self.get_writer(create=False)
+        if writer is not None:
+            writer.close()
+            del chunk_writers[self.writer_id]
+
+def chunk_distance_params(
+    num_bytes_for_each_distance: int = 1,
+    metric: str = 'edit',
+    max_distance: Optional[int] = None
+) -> dict:
+    return {
+        'dtype': np.dtype(num_bytes_to_uint_dtype(num_bytes_for_each_distance)).name,
+        'metric': metric,
+        'max_distance': distance_cap(num_bytes_for_each_distance, max_distance)
+    }
+
+
+def chunk_skipped_pairs(
+    chunk_params: ChunkParams,
+    num_bytes_for_each_distance: int = 1,
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    sketch_params: Optional[SketchParams] = None,
+    pruning_stats: Optional[PruningStats] = None,
+    shared_sketches: Optional[SharedSketches] = None
+) -> Optional[np.ndarray]:
+    if sketch_params is None or metric != 'edit':
+        return None
+    cap = distance_cap(num_bytes_for_each_distance, max_distance)
+    if isinstance(chunk_params, ChunkParamsDiagonal):
+        sketches = (
+            shared_sketches.get_chunk(chunk_params.index) if shared_sketches is not None
+            else None
+        )
+        skip_pairs = skipped_pairs_mask(
+            chunk_params.strings, chunk_params.strings, sketch_params, cap, only_triu=True,
+            row_sketches=sketches, col_sketches=sketches
+        )
+        num_pairs = triu_size(len(chunk_params.strings))
+    else:
+        skip_pairs = skipped_pairs_mask(
+            chunk_params.row_strings, chunk_params.col_strings, sketch_params, cap,
+            row_sketches=(
+                shared_sketches.get_chunk(chunk_params.row_index) if shared_sketches is not None
+                else None
+            ),
+            col_sketches=(
+                shared_sketches.get_chunk(chunk_params.col_index) if shared_sketches is not None
+                else None
+            )
+        )
+        num_pairs = skip_pairs.size
+    if pruning_stats is not None:
+        num_pruned_pairs = int(np.count_nonzero(skip_pairs))
+        if num_pruned_pairs == num_pairs and isinstance(chunk_params, ChunkParamsInternal):
+            pruning_stats.pruned_tiles += 1
+        pruning_stats.pruned_pairs += num_pruned_pairs
+        pruning_stats.total_pairs += num_pairs
+    return skip_pairs
 
 def compute_chunk(
     chunk_params: ChunkParams,
-    num_bytes_for_each_distance: int = 1
+    num_bytes_for_each_distance: int = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    sketch_params: Optional[SketchParams] = None,
+    pruning_stats: Optional[PruningStats] = None,
+    shared_sketches: Optional[SharedSketches] = None
 ) -> ChunkResults:
+    chunk_params = chunk_params.resolve_strings()
+    skip_pairs = chunk_skipped_pairs(
+        chunk_params,
+        num_bytes_for_each_distance,
+        metric=metric,
+        max_distance=max_distance,
+        sketch_params=sketch_params,
+        pruning_stats=pruning_stats,
+        shared_sketches=shared_sketches
+    )
     if isinstance(chunk_params, ChunkParamsDiagonal):
         return ChunkResultsDiagonal(
             index=chunk_params.index,
             dist_triu=build_string_distance_triu(
                 chunk_params.strings,
-                num_bytes_for_each_distance)
+                num_bytes_for_each_distance,
+                kernel=kernel,
+                metric=metric,
+                max_distance=max_distance,
+                skip_pairs=skip_pairs)
         )
     if isinstance(chunk_params, ChunkParamsInternal):
         return ChunkResultsInternal(
@@ -220,37 +1047,320 @@ def compute_chunk(
             dist_matrix=build_string_cross_distance_matrix(
                 row_strings=chunk_params.row_strings,
                 col_strings=chunk_params.col_strings,
-                num_bytes_for_each_distance=num_bytes_for_each_distance
+                num_bytes_for_each_distance=num_bytes_for_each_distance,
+                kernel=kernel,
+                metric=metric,
+                max_distance=max_distance,
+                skip_pairs=skip_pairs
             )
         )
 
 def compute_chunk_if_needed(
     chunk_params: ChunkParams,
     chunk_store: ChunkStore = dummy_chunk_store,
-    num_bytes_for_each_distance: int = 1
+    num_bytes_for_each_distance: int = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    sketch_params: Optional[SketchParams] = None,
+    pruning_stats: Optional[PruningStats] = None,
+    store_chunk: bool = True,
+    shared_sketches: Optional[SharedSketches] = None
 ) -> ChunkResults:
-    cached_chunk_results = chunk_store.get(chunk_params)
+    chunk_params = chunk_params.resolve_strings()
+    chunk_key = chunk_params.get_key(chunk_distance_params(
+        num_bytes_for_each_distance,
+        metric=metric,
+        max_distance=max_distance
+    ))
+    cached_chunk_results = chunk_store.get(chunk_params, chunk_key=chunk_key)
     if cached_chunk_results is not None:
         return cached_chunk_results
     fresh_chunk_results = compute_chunk(
         chunk_params,
-        num_bytes_for_each_distance
+        num_bytes_for_each_distance,
+        kernel=kernel,
+        metric=metric,
+        max_distance=max_distance,
+        sketch_params=sketch_params,
+        pruning_stats=pruning_stats,
+        shared_sketches=shared_sketches
     )
-    chunk_store.set(chunk_params, fresh_chunk_results)
+    if store_chunk:
+        chunk_store.set(chunk_params, fresh_chunk_results, chunk_key=chunk_key)
     return fresh_chunk_results
 
 def execute_job(
     job_params: JobParams,
     chunk_store: ChunkStore = dummy_chunk_store,
-    num_bytes_for_each_distance: int = 1
-) -> JobResult:
-    return JobResult([
+    num_bytes_for_each_distance: int = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    shared_result: Optional[SharedResultMatrix] = None,
+    sketch_params: Optional[SketchParams] = None,
+    store_chunks: bool = True,
+    shared_sketches: Optional[SharedSketches] = None
+) -> Union[JobResult, JobStatus]:
+    pruning_stats = PruningStats() if sketch_params is not None else None
+    chunk_results = [
         compute_chunk_if_needed(
             chunk_params, chunk_store,
-            num_bytes_for_each_distance
+            num_bytes_for_each_distance,
+            kernel=kernel,
+            metric=metric,
+            max_distance=max_distance,
+            sketch_params=sketch_params,
+            pruning_stats=pruning_stats,
+            store_chunk=store_chunks,
+            shared_sketches=shared_sketches
         )
         for chunk_params in job_params.chunk_params
-    ])
+    ]
+    if store_chunks:
+        chunk_store.flush()
+    if shared_result is None:
+        return JobResult(chunk_results, pruning_stats=pruning_stats)
+    for chunk_result in chunk_results:
+        if shared_result.cross:
+            store_cross_chunk_results(
+                chunk_result,
+                attach_memmap(shared_result.filename),
+                chunk_size=shared_result.chunk_size
+            )
+        else:
+            store_chunk_results(
+                chunk_result,
+                attach_memmap(shared_result.filename),
+                chunk_size=shared_result.chunk_size,
+                num_strings=shared_result.num_strings
+            )
+    return JobStatus(
+        [chunk_params.get_index() for chunk_params in job_params.chunk_params],
+        pruning_stats=pruning_stats
+    )
+
+
+def store_chunk_results(
+    chunk_results: ChunkResults,
+    global_dist: np.ndarray,
+    chunk_size: int,
+    num_strings: int
+):
+    if isinstance(chunk_results, ChunkResultsDiagonal):
+        row_offset = col_offset = chunk_results.index * chunk_size
+    elif isinstance(chunk_results, ChunkResultsInternal):
+        row_offset = chunk_results.row_index * chunk_size
+        col_offset = chunk_results.col_index * chunk_size
+    block = chunk_results.get_data()
+    if global_dist.ndim == 1:
+        set_triu_block(
+            global_dist, num_strings,
+            row_offset=row_offset,
+            col_offset=col_offset,
+            block=block
+        )
+        return
+    row_end = row_offset + block.shape[0]
+    col_end = col_offset + block.shape[1]
+    if isinstance(chunk_results, ChunkResultsDiagonal):
+        global_dist[row_offset:row_end, col_offset:col_end] = block + block.T
+    else:
+        global_dist[row_offset:row_end, col_offset:col_end] = block
+        global_dist[col_offset:col_end, row_offset:row_end] = block.T
+
+
+def string_chunk(
+    strings: list[str],
+    shared_strings: Optional[SharedStrings],
+    index: int,
+    chunk_size: int
+) -> Union[list[str], SharedStringsSlice]:
+    offset = index * chunk_size
+    if shared_strings is not None:
+        return SharedStringsSlice(
+            shared_strings,
+            start=offset,
+            end=min(offset + chunk_size, len(strings))
+        )
+    return strings[offset:offset + chunk_size]
+
+
+def distance_matrix_blocks(
+    strings: list[str],
+    shared_strings: Optional[SharedStrings],
+    num_chunks: int,
+    chunk_size: int
+) -> list[ChunkParams]:
+    internal_blocks = [
+        ChunkParamsInternal(
+            row_strings=string_chunk(strings, shared_strings, row_index, chunk_size),
+            col_strings=string_chunk(strings, shared_strings, col_index, chunk_size),
+            row_index=row_index,
+            col_index=col_index
+        )
+        for col_index in range(num_chunks)
+        for row_index in range(col_index)
+    ]
+    diagonal_blocks = [
+        ChunkParamsDiagonal(
+            strings=string_chunk(strings, shared_strings, index, chunk_size),
+            index=index
+        )
+        for index in range(num_chunks)
+    ]
+    return internal_blocks + diagonal_blocks
+
+
+def prune_blocks(
+    blocks: list[ChunkParams],
+    row_summaries: list[SketchSummary],
+    col_summaries: list[SketchSummary],
+    sketch_params: SketchParams,
+    max_distance: int,
+    pruning_stats: PruningStats
+) -> tuple[list[ChunkParams], list[ChunkParams]]:
+    kept_blocks = []
+    pruned_blocks = []
+    for block in blocks:
+        pruning_stats.total_tiles += 1
+        if isinstance(block, ChunkParamsInternal) and tile_lower_bound(
+            row_summaries[block.row_index],
+            col_summaries[block.col_index],
+            sketch_params
+        ) >= max_distance:
+            num_pairs = len(block.row_strings) * len(block.col_strings)
+            pruning_stats.pruned_tiles += 1
+            pruning_stats.pruned_pairs += num_pairs
+            pruning_stats.total_pairs += num_pairs
+            pruned_blocks.append(block)
+        else:
+            kept_blocks.append(block)
+    return kept_blocks, pruned_blocks
+
+
+class ChunkStoreMatrix:
+    strings: list[str]
+    num_items: int
+    chunk_size: int
+    num_chunks: int
+    chunk_store: ChunkStore
+    num_bytes_for_each_distance: int
+    metric: str
+    max_distance: Optional[int]
+    distance_params: dict
+    ndim: int = 2
+
+    def __init__(
+        self,
+        strings: list[str],
+        chunk_store: ChunkStore,
+        num_chunks: int,
+        num_bytes_for_each_distance: int = 1,
+        metric: str = 'edit',
+        max_distance: Optional[int] = None
+    ) -> None:
+        self.strings = strings
+        self.num_items = len(strings)
+        self.chunk_size = math.ceil(self.num_items / num_chunks)
+        self.num_chunks = math.ceil(self.num_items / self.chunk_size)
+        self.chunk_store = chunk_store
+        self.num_bytes_for_each_distance = num_bytes_for_each_distance
+        self.metric = metric
+        self.max_distance = max_distance
+        self.distance_params = chunk_distance_params(
+            num_bytes_for_each_distance,
+            metric=metric,
+            max_distance=max_distance
+        )
+        self.blocks = {
+            (block.get_index().row, block.get_index().col): block
+            for block in distance_matrix_blocks(strings, None, self.num_chunks, self.chunk_size)
+        }
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return (self.num_items, self.num_items)
+
+    def __len__(self):
+        return self.num_items
+
+    def get_block(self, row_index: int, col_index: int) -> np.ndarray:
+        block = self.blocks[(row_index, col_index)]
+        chunk_results = self.chunk_store.get_mapped(
+            block, chunk_key=block.get_key(self.distance_params)
+        )
+        if chunk_results is None:
+            raise Exception(f'Chunk {block} is missing from the chunk store')
+        return chunk_results.get_data()
+
+    def get_row(self, row: int) -> np.ndarray:
+        raise Exception(
+            'ChunkStoreMatrix rows are spread over a whole chunk row of tiles, ' +
+            'use single_linkage_clustering to scan them tile by tile'
+        )
+
+    def single_linkage_clustering(
+        self,
+        max_num_processes: Optional[int] = None
+    ) -> LinkageClustering:
+        return build_string_single_linkage_by_chunks(
+            self.strings,
+            num_chunks=self.num_chunks,
+            max_num_processes=max_num_processes,
+            chunk_store=self.chunk_store,
+            num_bytes_for_each_distance=self.num_bytes_for_each_distance,
+            metric=self.metric,
+            max_distance=self.max_distance
+        )
+
+
+def load_cached_chunks(
+    chunks_params: list[ChunkParams],
+    chunk_store: ChunkStore,
+    distance_params: dict,
+    store_results
+) -> list[ChunkParams]:
+    if chunk_store is dummy_chunk_store:
+        return chunks_params
+    missing_chunks_params = []
+    for chunk_params in chunks_params:
+        cached_chunk_results = chunk_store.get_mapped(
+            chunk_params,
+            chunk_key=chunk_params.get_key(distance_params)
+        )
+        if cached_chunk_results is None:
+            missing_chunks_params.append(chunk_params)
+        else:
+            store_results(cached_chunk_results)
+    print(
+        f"Cached chunks: {len(chunks_params) - len(missing_chunks_params)}, " +
+        f"chunks to compute: {len(missing_chunks_params)}"
+    )
+    return missing_chunks_params
+
+
+def index_chunks_params(chunks_params: list[ChunkParams]) -> dict[tuple[int, int], ChunkParams]:
+    return {
+        (chunk_params.get_index().row, chunk_params.get_index().col): chunk_params
+        for chunk_params in chunks_params
+    }
+
+
+def store_computed_chunks(
+    chunks_results: list[ChunkResults],
+    chunk_store: ChunkStore,
+    chunks_params_by_index: dict[tuple[int, int], ChunkParams],
+    distance_params: dict
+):
+    for chunk_results in chunks_results:
+        index = chunk_results.get_index()
+        chunk_params = chunks_params_by_index[(index.row, index.col)]
+        chunk_store.set(
+            chunk_params,
+            chunk_results,
+            chunk_key=chunk_params.get_key(distance_params)
+        )
 
 
 def build_string_distance_matrix_by_chunks(
@@ -258,8 +1368,46 @@ def build_string_distance_matrix_by_chunks(
     num_chunks: int = None,
     max_num_processes: int = None,
     chunk_store: ChunkStore = dummy_chunk_store,
-    num_bytes_for_each_distance = 1
-) -> np.ndarray:
+    num_bytes_for_each_distance = 1,
+    layout: str = 'square',
+    output_filename: str = None,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    collapse_duplicates: bool = False,
+    tiles_per_process: int = 4,
+    share_strings: bool = True,
+    write_in_place: bool = False,
+    sketch_params: Optional[SketchParams] = None
+) -> Union[np.ndarray, DeduplicatedMatrix]:
+
+    if layout not in ['square', 'condensed']:
+        raise Exception(f'Unsupported distance matrix layout: {layout}')
+    check_distance_kernel(kernel)
+    check_distance_metric(metric)
+
+    if collapse_duplicates:
+        item_to_unique, unique_strings = deduplicate_items(strings)
+        print(f"Unique strings: {len(unique_strings)} out of {len(strings)}")
+        return DeduplicatedMatrix(
+            unique_matrix=build_string_distance_matrix_by_chunks(
+                strings=unique_strings,
+                num_chunks=num_chunks,
+                max_num_processes=max_num_processes,
+                chunk_store=chunk_store,
+                num_bytes_for_each_distance=num_bytes_for_each_distance,
+                layout=layout,
+                output_filename=output_filename,
+                kernel=kernel,
+                metric=metric,
+                max_distance=max_distance,
+                tiles_per_process=tiles_per_process,
+                share_strings=share_strings,
+                write_in_place=write_in_place,
+                sketch_params=sketch_params
+            ),
+            item_to_unique=item_to_unique
+        )
 
     num_strings = len(strings)
 
@@ -267,7 +1415,7 @@ def build_string_distance_matrix_by_chunks(
         if (max_num_processes is None):
             print(f"CPUs detected: {multiprocessing.cpu_count()}")
             max_num_processes = multiprocessing.cpu_count()
-        num_chunks = int(math.sqrt(max_num_processes * 2))
+        num_chunks = max(1, int(math.sqrt(max_num_processes * 2 * tiles_per_process)))
 
     print(f"# of chunks for computing distance matrix: {num_chunks}")
 
@@ -277,89 +1425,969 @@ def build_string_distance_matrix_by_chunks(
     
     num_chunks = math.ceil(num_strings / chunk_size)
 
-    def chunk(index):
-        offset = index * chunk_size
-        return strings[offset:offset + chunk_size]
+    shared_result = None
+    shared_sketches = None
+    shared_strings = None
+    shared_strings_memory = None
+    if share_strings:
+        shared_strings, shared_strings_memory = create_shared_strings(strings)
 
-    internal_blocks = [
-        ChunkParamsInternal(
-            row_strings=chunk(row_index),
-            col_strings=chunk(col_index),
-            row_index=row_index,
-            col_index=col_index
+    blocks = distance_matrix_blocks(strings, shared_strings, num_chunks, chunk_size)
+
+    try:
+        dist_dtype = num_bytes_to_uint_dtype(num_bytes_for_each_distance)
+        if write_in_place:
+            shared_result = SharedResultMatrix(
+                filename=(
+                    output_filename if output_filename is not None
+                    else shared_temp_filename()
+                ),
+                chunk_size=chunk_size,
+                num_strings=num_strings
+            )
+            global_dist = open_matrix_memmap(
+                shared_result.filename, num_strings, dtype=dist_dtype, layout=layout
+            )
+        elif output_filename is not None:
+            global_dist = open_matrix_memmap(
+                output_filename, num_strings, dtype=dist_dtype, layout=layout
+            )
+        elif layout == 'condensed':
+            global_dist = np.zeros(triu_size(num_strings), dtype=dist_dtype)
+        else:
+            global_dist = np.zeros((num_strings, num_strings), dtype=dist_dtype)
+
+        distance_params = chunk_distance_params(
+            num_bytes_for_each_distance,
+            metric=metric,
+            max_distance=max_distance
+        )
+        missing_blocks = load_cached_chunks(
+            blocks,
+            chunk_store=chunk_store,
+            distance_params=distance_params,
+            store_results=partial(
+                store_chunk_results,
+                global_dist=global_dist,
+                chunk_size=chunk_size,
+                num_strings=num_strings
+            )
         )
-        for col_index in range(num_chunks)
-        for row_index in range(col_index)
-    ]
 
-    diagonal_blocks = [
-        ChunkParamsDiagonal(
-            strings=chunk(index),
-            index=index
+        pruning_stats = None
+        if sketch_params is not None:
+            pruning_stats = PruningStats()
+            shared_sketches, chunk_summaries = create_shared_sketches(strings, chunk_size, sketch_params)
+            missing_blocks, pruned_blocks = prune_blocks(
+                missing_blocks,
+                row_summaries=chunk_summaries,
+                col_summaries=chunk_summaries,
+                sketch_params=sketch_params,
+                max_distance=distance_cap(num_bytes_for_each_distance, max_distance),
+                pruning_stats=pruning_stats
+            )
+            for pruned_block in pruned_blocks:
+                store_chunk_results(
+                    pruned_block.results_from_data(np.full(
+                        pruned_block.get_shape(),
+                        distance_cap(num_bytes_for_each_distance, max_distance),
+                        dtype=dist_dtype
+                    )),
+                    global_dist,
+                    chunk_size=chunk_size,
+                    num_strings=num_strings
+                )
+
+        jobs_params = sorted(
+            [JobParams([block]) for block in missing_blocks],
+            key=lambda job_params: job_params.get_cost(),
+            reverse=True
         )
-        for index in range(num_chunks)
-    ]
 
-    jobs_params = [
-        JobParams([internal_block])
-        for internal_block in internal_blocks
-    ] + [
-        JobParams(diagonal_blocks[i*2:(i+1)*2])
-        for i in range(math.ceil(len(diagonal_blocks) / 2))
-    ]
+        print(f"Num jobs: {len(jobs_params)}")
+        print(f"Blocks: {[str(jb) for jb in jobs_params]}")
+
+        parent_writes = chunk_store.writes_from_parent and shared_result is None
+        missing_blocks_by_index = index_chunks_params(missing_blocks) if parent_writes else None
+
+        if len(jobs_params) > 0:
+            with Pool(max_num_processes) as p:
+                for job_result in p.imap_unordered(
+                    partial(
+                        execute_job,
+                        chunk_store=chunk_store,
+                        num_bytes_for_each_distance=num_bytes_for_each_distance,
+                        kernel=kernel,
+                        metric=metric,
+                        max_distance=max_distance,
+                        shared_result=shared_result,
+                        sketch_params=sketch_params,
+                        store_chunks=not parent_writes,
+                        shared_sketches=shared_sketches
+                    ),
+                    jobs_params
+                ):
+                    if pruning_stats is not None:
+                        pruning_stats.add(job_result.pruning_stats)
+                    if isinstance(job_result, JobStatus):
+                        continue
+                    for chunk_result in job_result.chunk_results:
+                        store_chunk_results(
+                            chunk_result,
+                            global_dist,
+                            chunk_size=chunk_size,
+                            num_strings=num_strings
+                        )
+                    if parent_writes:
+                        store_computed_chunks(
+                            job_result.chunk_results, chunk_store, missing_blocks_by_index, distance_params
+                        )
+                p.close()
+                p.join()
+            if parent_writes:
+                chunk_store.flush()
 
-    print(f"Num processes: {len(jobs_params)}")
-    print(f"Blocks: {[str(jb) for jb in jobs_params]}")
+        if pruning_stats is not None:
+            print(f"Sketch prefilter {pruning_stats}")
+    finally:
+        if shared_strings_memory is not None:
+            release_shared_memory(shared_strings_memory)
+        if shared_result is not None and output_filename is None:
+            os.remove(shared_result.filename)
+        if shared_sketches is not None:
+            os.remove(shared_sketches.filename)
+
+    if output_filename is not None:
+        global_dist.flush()
+
+    return global_dist
+
+
+def build_seqs_distance_matrix_by_chunks(
+    seqs: list[SeqRecord],
+    num_chunks: int = None,
+    max_num_processes: int = None,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    layout: str = 'square',
+    output_filename: str = None,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    collapse_duplicates: bool = False,
+    tiles_per_process: int = 4,
+    share_strings: bool = True,
+    write_in_place: bool = False,
+    sketch_params: Optional[SketchParams] = None
+) -> Union[np.ndarray, DeduplicatedMatrix]:
+    return build_string_distance_matrix_by_chunks(
+        strings=[str(seq.seq) for seq in seqs],
+        num_chunks=num_chunks,
+        max_num_processes=max_num_processes,
+        chunk_store=chunk_store,
+        layout=layout,
+        output_filename=output_filename,
+        kernel=kernel,
+        metric=metric,
+        max_distance=max_distance,
+        collapse_duplicates=collapse_duplicates,
+        tiles_per_process=tiles_per_process,
+        share_strings=share_strings,
+        write_in_place=write_in_place,
+        sketch_params=sketch_params
+    )
+
+
+def chunk_results_to_pairs(
+    chunk_results: ChunkResults,
+    chunk_size: int,
+    max_distance: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if isinstance(chunk_results, ChunkResultsDiagonal):
+        row_offset = col_offset = chunk_results.index * chunk_size
+    elif isinstance(chunk_results, ChunkResultsInternal):
+        row_offset = chunk_results.row_index * chunk_size
+        col_offset = chunk_results.col_index * chunk_size
+    block = chunk_results.get_data()
+    rows, cols = np.nonzero(block <= max_distance)
+    if isinstance(chunk_results, ChunkResultsDiagonal):
+        upper = rows < cols
+        rows = rows[upper]
+        cols = cols[upper]
+    return (
+        rows.astype(np.int64) + row_offset,
+        cols.astype(np.int64) + col_offset,
+        np.asarray(block[rows, cols])
+    )
+
+
+def execute_graph_job(
+    job_params: JobParams,
+    chunk_size: int,
+    max_distance: int,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    num_bytes_for_each_distance: int = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    sketch_params: Optional[SketchParams] = None,
+    shared_sketches: Optional[SharedSketches] = None
+) -> GraphJobResult:
+    job_result = execute_job(
+        job_params,
+        chunk_store=chunk_store,
+        num_bytes_for_each_distance=num_bytes_for_each_distance,
+        kernel=kernel,
+        metric=metric,
+        max_distance=max_distance + 1,
+        sketch_params=sketch_params,
+        shared_sketches=shared_sketches
+    )
+    return GraphJobResult(
+        chunk_pairs=[
+            chunk_results_to_pairs(chunk_results, chunk_size=chunk_size, max_distance=max_distance)
+            for chunk_results in job_result.chunk_results
+        ],
+        pruning_stats=job_result.pruning_stats
+    )
+
+
+def build_string_distance_graph_by_chunks(
+    strings: list[str],
+    max_distance: int,
+    num_chunks: int = None,
+    max_num_processes: int = None,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    num_bytes_for_each_distance = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    collapse_duplicates: bool = False,
+    tiles_per_process: int = 4,
+    share_strings: bool = True,
+    sketch_params: Optional[SketchParams] = None
+) -> Union[scipy.sparse.csr_matrix, DeduplicatedMatrix]:
+    check_distance_kernel(kernel)
+    check_distance_metric(metric)
+    if max_distance + 1 > num_bytes_to_max_value(num_bytes_for_each_distance):
+        raise Exception(
+            f'max_distance {max_distance} does not fit in {num_bytes_for_each_distance} bytes per distance'
+        )
 
-    with Pool(max_num_processes) as p:
-        job_results = p.map(
-            partial(
-                execute_job,
+    if collapse_duplicates:
+        item_to_unique, unique_strings = deduplicate_items(strings)
+        print(f"Unique strings: {len(unique_strings)} out of {len(strings)}")
+        return DeduplicatedMatrix(
+            unique_matrix=build_string_distance_graph_by_chunks(
+                strings=unique_strings,
+                max_distance=max_distance,
+                num_chunks=num_chunks,
+                max_num_processes=max_num_processes,
                 chunk_store=chunk_store,
-                num_bytes_for_each_distance=num_bytes_for_each_distance
+                num_bytes_for_each_distance=num_bytes_for_each_distance,
+                kernel=kernel,
+                metric=metric,
+                tiles_per_process=tiles_per_process,
+                share_strings=share_strings,
+                sketch_params=sketch_params
             ),
-            jobs_params
+            item_to_unique=item_to_unique
         )
 
-    results_matrix = [
-        [
-            np.zeros((
-                chunk_size
-                if row_index < num_chunks - 1 or num_strings % chunk_size == 0
-                else num_strings % chunk_size,
-                chunk_size
-                if col_index < num_chunks - 1 or num_strings % chunk_size == 0
-                else num_strings % chunk_size
-            ), dtype=num_bytes_to_uint_dtype(num_bytes_for_each_distance))
-            for col_index in range(num_chunks)
-        ]
-        for row_index in range(num_chunks)
+    num_strings = len(strings)
+    dist_dtype = num_bytes_to_uint_dtype(num_bytes_for_each_distance)
+    if num_strings == 0:
+        return scipy.sparse.csr_matrix((0, 0), dtype=dist_dtype)
+
+    if (num_chunks is None):
+        if (max_num_processes is None):
+            print(f"CPUs detected: {multiprocessing.cpu_count()}")
+            max_num_processes = multiprocessing.cpu_count()
+        num_chunks = max(1, int(math.sqrt(max_num_processes * 2 * tiles_per_process)))
+
+    chunk_size = math.ceil(num_strings / num_chunks)
+    num_chunks = math.ceil(num_strings / chunk_size)
+
+    print(f"# of chunks for computing distance graph: {num_chunks}")
+    print(f"Chunk size: {chunk_size}")
+
+    pairs = []
+
+    def store_pairs(chunk_results: ChunkResults):
+        pairs.append(chunk_results_to_pairs(
+            chunk_results, chunk_size=chunk_size, max_distance=max_distance
+        ))
+
+    shared_strings = None
+    shared_strings_memory = None
+    shared_sketches = None
+    try:
+        if share_strings:
+            shared_strings, shared_strings_memory = create_shared_strings(strings)
+
+        missing_blocks = load_cached_chunks(
+            distance_matrix_blocks(strings, shared_strings, num_chunks, chunk_size),
+            chunk_store=chunk_store,
+            distance_params=chunk_distance_params(
+                num_bytes_for_each_distance,
+                metric=metric,
+                max_distance=max_distance + 1
+            ),
+            store_results=store_pairs
+        )
+
+        pruning_stats = None
+        if sketch_params is not None:
+            pruning_stats = PruningStats()
+            shared_sketches, chunk_summaries = create_shared_sketches(strings, chunk_size, sketch_params)
+            missing_blocks, _ = prune_blocks(
+                missing_blocks,
+                row_summaries=chunk_summaries,
+                col_summaries=chunk_summaries,
+                sketch_params=sketch_params,
+                max_distance=max_distance + 1,
+                pruning_stats=pruning_stats
+            )
+
+        jobs_params = sorted(
+            [JobParams([block]) for block in missing_blocks],
+            key=lambda job_params: job_params.get_cost(),
+            reverse=True
+        )
+
+        print(f"Num jobs: {len(jobs_params)}")
+
+        if len(jobs_params) > 0:
+            with Pool(max_num_processes) as p:
+                for job_result in p.imap_unordered(
+                    partial(
+                        execute_graph_job,
+                        chunk_size=chunk_size,
+                        max_distance=max_distance,
+                        chunk_store=chunk_store,
+                        num_bytes_for_each_distance=num_bytes_for_each_distance,
+                        kernel=kernel,
+                        metric=metric,
+                        sketch_params=sketch_params,
+                        shared_sketches=shared_sketches
+                    ),
+                    jobs_params
+                ):
+                    pairs.extend(job_result.chunk_pairs)
+                    if pruning_stats is not None:
+                        pruning_stats.add(job_result.pruning_stats)
+                p.close()
+                p.join()
+
+        if pruning_stats is not None:
+            print(f"Sketch prefilter {pruning_stats}")
+    finally:
+        if shared_strings_memory is not None:
+            release_shared_memory(shared_strings_memory)
+        if shared_sketches is not None:
+            os.remove(shared_sketches.filename)
+
+    rows = np.concatenate([chunk_pairs[0] for chunk_pairs in pairs])
+    cols = np.concatenate([chunk_pairs[1] for chunk_pairs in pairs])
+    distances = np.concatenate([chunk_pairs[2] for chunk_pairs in pairs]).astype(dist_dtype)
+
+    print(f"Pairs within distance {max_distance}: {len(distances)}")
+
+    return scipy.sparse.coo_matrix(
+        (distances, (rows, cols)),
+        shape=(num_strings, num_strings)
+    ).tocsr()
+
+
+def build_seqs_distance_graph_by_chunks(
+    seqs: list[SeqRecord],
+    max_distance: int,
+    num_chunks: int = None,
+    max_num_processes: int = None,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    num_bytes_for_each_distance = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    collapse_duplicates: bool = False,
+    tiles_per_process: int = 4,
+    share_strings: bool = True,
+    sketch_params: Optional[SketchParams] = None
+) -> Union[scipy.sparse.csr_matrix, DeduplicatedMatrix]:
+    return build_string_distance_graph_by_chunks(
+        strings=[str(seq.seq) for seq in seqs],
+        max_distance=max_distance,
+        num_chunks=num_chunks,
+        max_num_processes=max_num_processes,
+        chunk_store=chunk_store,
+        num_bytes_for_each_distance=num_bytes_for_each_distance,
+        kernel=kernel,
+        metric=metric,
+        collapse_duplicates=collapse_duplicates,
+        tiles_per_process=tiles_per_process,
+        share_strings=share_strings,
+        sketch_params=sketch_params
+    )
+
+
+def chunk_outgoing_edges(
+    chunk_results: ChunkResults,
+    components: np.ndarray,
+    chunk_size: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    if isinstance(chunk_results, ChunkResultsDiagonal):
+        row_offset = col_offset = chunk_results.index * chunk_size
+    elif isinstance(chunk_results, ChunkResultsInternal):
+        row_offset = chunk_results.row_index * chunk_size
+        col_offset = chunk_results.col_index * chunk_size
+    block = chunk_results.get_data().astype(np.int64)
+    if isinstance(chunk_results, ChunkResultsDiagonal):
+        block += block.T
+    row_items = np.arange(row_offset, row_offset + block.shape[0])
+    col_items = np.arange(col_offset, col_offset + block.shape[1])
+    no_edge = np.iinfo(np.int64).max
+    block[components[row_items][:, None] == components[col_items][None, :]] = no_edge
+    best_cols = np.argmin(block, axis=1)
+    item_edges = [(row_items, col_items[best_cols], block[np.arange(len(row_items)), best_cols])]
+    if isinstance(chunk_results, ChunkResultsInternal):
+        best_rows = np.argmin(block, axis=0)
+        item_edges.append((col_items, row_items[best_rows], block[best_rows, np.arange(len(col_items))]))
+    items = np.concatenate([edges[0] for edges in item_edges])
+    partners = np.concatenate([edges[1] for edges in item_edges])
+    distances = np.concatenate([edges[2] for edges in item_edges])
+    valid = distances < no_edge
+    return min_edges_by_component(
+        components[items[valid]],
+        distances[valid],
+        np.minimum(items, partners)[valid],
+        np.maximum(items, partners)[valid]
+    )
+
+
+def min_edges_by_component(
+    edge_components: np.ndarray,
+    edge_distances: np.ndarray,
+    edge_rows: np.ndarray,
+    edge_cols: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    edges_order = np.lexsort((edge_cols, edge_rows, edge_distances, edge_components))
+    sorted_components = edge_components[edges_order]
+    first_edges = edges_order[
+        np.r_[True, sorted_components[1:] != sorted_components[:-1]][:len(edges_order)]
     ]
+    return (
+        edge_components[first_edges],
+        edge_distances[first_edges],
+        edge_rows[first_edges],
+        edge_cols[first_edges]
+    )
 
-    for job_result in job_results:
-        for chunk_result in job_result.chunk_results:
-            if isinstance(chunk_result, ChunkResultsDiagonal):
-                results_matrix[chunk_result.index][chunk_result.index] = chunk_result.dist_triu
-            elif isinstance(chunk_result, ChunkResultsInternal):
-                results_matrix[chunk_result.row_index][chunk_result.col_index] = chunk_result.dist_matrix
 
-    print(
-        f"Block result shapes: {[[result.shape for result in results_row] for results_row in results_matrix]}")
+def execute_boruvka_job(
+    job_params: JobParams,
+    components_filename: str,
+    chunk_size: int,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    num_bytes_for_each_distance: int = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    sketch_params: Optional[SketchParams] = None,
+    shared_sketches: Optional[SharedSketches] = None
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    components = attach_memmap(components_filename)
+    chunks_edges = [
+        chunk_outgoing_edges(
+            compute_chunk_if_needed(
+                chunk_params, chunk_store,
+                num_bytes_for_each_distance,
+                kernel=kernel,
+                metric=metric,
+                max_distance=max_distance,
+                sketch_params=sketch_params,
+                shared_sketches=shared_sketches
+            ),
+            components,
+            chunk_size=chunk_size
+        )
+        for chunk_params in job_params.chunk_params
+    ]
+    chunk_store.flush()
+    return min_edges_by_component(*[
+        np.concatenate([chunk_edges[field] for chunk_edges in chunks_edges])
+        for field in range(4)
+    ])
 
-    global_dist_triu = np.block(results_matrix)
-    return global_dist_triu + global_dist_triu.T
-    # np.zeros((num_strings, num_strings))
 
+def merge_min_edges(
+    best_edges: tuple[np.ndarray, np.ndarray, np.ndarray],
+    new_edges: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+):
+    best_distances, best_rows, best_cols = best_edges
+    edge_components, edge_distances, edge_rows, edge_cols = new_edges
+    current_distances = best_distances[edge_components]
+    current_rows = best_rows[edge_components]
+    better = (edge_distances < current_distances) | (
+        (edge_distances == current_distances) & (
+            (edge_rows < current_rows) |
+            ((edge_rows == current_rows) & (edge_cols < best_cols[edge_components]))
+        )
+    )
+    best_distances[edge_components[better]] = edge_distances[better]
+    best_rows[edge_components[better]] = edge_rows[better]
+    best_cols[edge_components[better]] = edge_cols[better]
 
-def build_seqs_distance_matrix_by_chunks(
+
+def component_labels(parents: np.ndarray) -> np.ndarray:
+    labels = parents.copy()
+    while True:
+        next_labels = parents[labels]
+        if np.array_equal(next_labels, labels):
+            return labels
+        labels = next_labels
+
+
+def build_string_single_linkage_by_chunks(
+    strings: list[str],
+    num_chunks: int = None,
+    max_num_processes: int = None,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    num_bytes_for_each_distance = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    tiles_per_process: int = 4,
+    share_strings: bool = True,
+    sketch_params: Optional[SketchParams] = None
+) -> LinkageClustering:
+    check_distance_kernel(kernel)
+    check_distance_metric(metric)
+
+    num_strings = len(strings)
+    if num_strings < 2:
+        return spanning_edges_to_clustering(
+            num_strings,
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0, dtype=np.int64),
+            np.zeros(0)
+        )
+
+    if (num_chunks is None):
+        if (max_num_processes is None):
+            print(f"CPUs detected: {multiprocessing.cpu_count()}")
+            max_num_processes = multiprocessing.cpu_count()
+        num_chunks = max(1, int(math.sqrt(max_num_processes * 2 * tiles_per_process)))
+
+    chunk_size = math.ceil(num_strings / num_chunks)
+    num_chunks = math.ceil(num_strings / chunk_size)
+
+    print(f"# of chunks for single linkage: {num_chunks}")
+    print(f"Chunk size: {chunk_size}")
+
+    parents = np.arange(num_strings, dtype=np.int64)
+    no_edge = np.iinfo(np.int64).max
+    spanning_rows = []
+    spanning_cols = []
+    spanning_distances = []
+
+    def find_root(item: int) -> int:
+        while parents[item] != item:
+            parents[item] = parents[parents[item]]
+            item = parents[item]
+        return item
+
+    components_filename = shared_temp_filename()
+    shared_strings = None
+    shared_strings_memory = None
+    shared_sketches = None
+    try:
+        components = np.lib.format.open_memmap(
+            components_filename, mode='w+', dtype=np.int64, shape=(num_strings,)
+        )
+        components[:] = parents
+        components.flush()
+        if share_strings:
+            shared_strings, shared_strings_memory = create_shared_strings(strings)
+        blocks = distance_matrix_blocks(strings, shared_strings, num_chunks, chunk_size)
+        if sketch_params is not None:
+            shared_sketches, _ = create_shared_sketches(strings, chunk_size, sketch_params)
+
+        with Pool(max_num_processes) as p:
+            num_components = num_strings
+            round_index = 0
+            while num_components > 1:
+                chunk_components = [
+                    components[offset:offset + chunk_size]
+                    for offset in range(0, num_strings, chunk_size)
+                ]
+                chunk_labels = [
+                    int(labels[0]) if labels.min() == labels.max() else None
+                    for labels in chunk_components
+                ]
+                jobs_params = sorted(
+                    [
+                        JobParams([block]) for block in blocks
+                        if chunk_labels[block.get_index().row] is None or
+                        chunk_labels[block.get_index().row] != chunk_labels[block.get_index().col]
+                    ],
+                    key=lambda job_params: job_params.get_cost(),
+                    reverse=True
+                )
+                print(f"Boruvka round {round_index}: {num_components} components, {len(jobs_params)} jobs")
+
+                best_edges = (
+                    np.full(num_strings, no_edge, dtype=np.int64),
+                    np.full(num_strings, no_edge, dtype=np.int64),
+                    np.full(num_strings, no_edge, dtype=np.int64)
+                )
+                for job_edges in p.imap_unordered(
+                    partial(
+                        execute_boruvka_job,
+                        components_filename=components_filename,
+                        chunk_size=chunk_size,
+                        chunk_store=chunk_store,
+                        num_bytes_for_each_distance=num_bytes_for_each_distance,
+                        kernel=kernel,
+                        metric=metric,
+                        max_distance=max_distance,
+                        sketch_params=sketch_params,
+                        shared_sketches=shared_sketches
+                    ),
+                    jobs_params
+                ):
+                    merge_min_edges(best_edges, job_edges)
+
+                best_distances, best_rows, best_cols = best_edges
+                for component in np.nonzero(best_distances < no_edge)[0]:
+                    row_root = find_root(int(best_rows[component]))
+                    col_root = find_root(int(best_cols[component]))
+                    if row_root == col_root:
+                        continue
+                    parents[col_root] = row_root
+                    spanning_rows.append(int(best_rows[component]))
+                    spanning_cols.append(int(best_cols[component]))
+                    spanning_distances.append(int(best_distances[component]))
+                    num_components -= 1
+
+                parents[:] = component_labels(parents)
+                components[:] = parents
+                components.flush()
+                round_index += 1
+            p.close()
+            p.join()
+    finally:
+        if shared_strings_memory is not None:
+            release_shared_memory(shared_strings_memory)
+        if shared_sketches is not None:
+            os.remove(shared_sketches.filename)
+        os.remove(components_filename)
+
+    return spanning_edges_to_clustering(
+        num_strings,
+        np.array(spanning_rows, dtype=np.int64),
+        np.array(spanning_cols, dtype=np.int64),
+        np.array(spanning_distances, dtype=np.float64)
+    )
+
+
+def build_seqs_single_linkage_by_chunks(
+    seqs: list[SeqRecord],
+    num_chunks: int = None,
+    max_num_processes: int = None,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    num_bytes_for_each_distance = 1,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    tiles_per_process: int = 4,
+    share_strings: bool = True,
+    sketch_params: Optional[SketchParams] = None
+) -> LinkageClustering:
+    return build_string_single_linkage_by_chunks(
+        strings=[str(seq.seq) for seq in seqs],
+        num_chunks=num_chunks,
+        max_num_processes=max_num_processes,
+        chunk_store=chunk_store,
+        num_bytes_for_each_distance=num_bytes_for_each_distance,
+        kernel=kernel,
+        metric=metric,
+        max_distance=max_distance,
+        tiles_per_process=tiles_per_process,
+        share_strings=share_strings,
+        sketch_params=sketch_params
+    )
+
+
+def store_cross_chunk_results(
+    chunk_results: ChunkResultsInternal,
+    cross_dist: np.ndarray,
+    chunk_size: int
+):
+    row_offset = chunk_results.row_index * chunk_size
+    col_offset = chunk_results.col_index * chunk_size
+    block = chunk_results.get_data()
+    cross_dist[
+        row_offset:row_offset + block.shape[0],
+        col_offset:col_offset + block.shape[1]
+    ] = block
+
+
+def build_string_cross_distance_matrix_by_chunks(
+    row_strings: list[str],
+    col_strings: list[str],
+    num_chunks: int = None,
+    max_num_processes: int = None,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    num_bytes_for_each_distance = 1,
+    output_filename: str = None,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    tiles_per_process: int = 4,
+    share_strings: bool = True,
+    write_in_place: bool = False
+) -> np.ndarray:
+    check_distance_kernel(kernel)
+    check_distance_metric(metric)
+
+    num_rows = len(row_strings)
+    num_cols = len(col_strings)
+
+    if max_num_processes is None:
+        print(f"CPUs detected: {multiprocessing.cpu_count()}")
+        max_num_processes = multiprocessing.cpu_count()
+    if num_chunks is None:
+        chunk_size = max(1, math.ceil(math.sqrt(
+            num_rows * num_cols / (max_num_processes * tiles_per_process)
+        )))
+    else:
+        chunk_size = max(1, math.ceil(max(num_rows, num_cols) / num_chunks))
+
+    print(f"Chunk size for cross distance matrix: {chunk_size}")
+
+    shared_result = None
+    shared_memories = []
+    shared_row_strings = None
+    shared_col_strings = None
+    dist_dtype = num_bytes_to_uint_dtype(num_bytes_for_each_distance)
+
+    try:
+        if share_strings and num_rows > 0 and num_cols > 0:
+            shared_row_strings, shared_memory = create_shared_strings(row_strings)
+            shared_memories.append(shared_memory)
+            shared_col_strings, shared_memory = create_shared_strings(col_strings)
+            shared_memories.append(shared_memory)
+
+        blocks = [
+            ChunkParamsInternal(
+                row_index=row_index,
+                col_index=col_index,
+                row_strings=string_chunk(row_strings, shared_row_strings, row_index, chunk_size),
+                col_strings=string_chunk(col_strings, shared_col_strings, col_index, chunk_size)
+            )
+            for row_index in range(math.ceil(num_rows / chunk_size))
+            for col_index in range(math.ceil(num_cols / chunk_size))
+        ]
+
+        if write_in_place:
+            shared_result = SharedResultMatrix(
+                filename=(
+                    output_filename if output_filename is not None
+                    else shared_temp_filename()
+                ),
+                chunk_size=chunk_size,
+                num_strings=num_rows,
+                cross=True
+            )
+            cross_dist = np.lib.format.open_memmap(
+                shared_result.filename, mode='w+', dtype=dist_dtype, shape=(num_rows, num_cols)
+            )
+        elif output_filename is not None:
+            cross_dist = np.lib.format.open_memmap(
+                output_filename, mode='w+', dtype=dist_dtype, shape=(num_rows, num_cols)
+            )
+        else:
+            cross_dist = np.zeros((num_rows, num_cols), dtype=dist_dtype)
+
+        store_results = partial(store_cross_chunk_results, cross_dist=cross_dist, chunk_size=chunk_size)
+        distance_params = chunk_distance_params(
+            num_bytes_for_each_distance,
+            metric=metric,
+            max_distance=max_distance
+        )
+        missing_blocks = load_cached_chunks(
+            blocks,
+            chunk_store=chunk_store,
+            distance_params=distance_params,
+            store_results=store_results
+        )
+
+        jobs_params = sorted(
+            [JobParams([block]) for block in missing_blocks],
+            key=lambda job_params: job_params.get_cost(),
+            reverse=True
+        )
+
+        print(f"Num jobs: {len(jobs_params)}")
+
+        parent_writes = chunk_store.writes_from_parent and shared_result is None
+        missing_blocks_by_index = index_chunks_params(missing_blocks) if parent_writes else None
+
+        if len(jobs_params) > 0:
+            with Pool(max_num_processes) as p:
+                for job_result in p.imap_unordered(
+                    partial(
+                        execute_job,
+                        chunk_store=chunk_store,
+                        num_bytes_for_each_distance=num_bytes_for_each_distance,
+                        kernel=kernel,
+                        metric=metric,
+                        max_distance=max_distance,
+                        shared_result=shared_result,
+                        store_chunks=not parent_writes
+                    ),
+                    jobs_params
+                ):
+                    if isinstance(job_result, JobStatus):
+                        continue
+                    for chunk_result in job_result.chunk_results:
+                        store_results(chunk_result)
+                    if parent_writes:
+                        store_computed_chunks(
+                            job_result.chunk_results, chunk_store, missing_blocks_by_index, distance_params
+                        )
+                p.close()
+                p.join()
+            if parent_writes:
+                chunk_store.flush()
+    finally:
+        for shared_memory in shared_memories:
+            release_shared_memory(shared_memory)
+        if shared_result is not None and output_filename is None:
+            os.remove(shared_result.filename)
+
+    if output_filename is not None:
+        cross_dist.flush()
+
+    return cross_dist
+
+
+def build_seqs_cross_distance_matrix_by_chunks(
+    row_seqs: list[SeqRecord],
+    col_seqs: list[SeqRecord],
+    num_chunks: int = None,
+    max_num_processes: int = None,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    output_filename: str = None,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    tiles_per_process: int = 4,
+    share_strings: bool = True,
+    write_in_place: bool = False
+) -> np.ndarray:
+    return build_string_cross_distance_matrix_by_chunks(
+        row_strings=[str(seq.seq) for seq in row_seqs],
+        col_strings=[str(seq.seq) for seq in col_seqs],
+        num_chunks=num_chunks,
+        max_num_processes=max_num_processes,
+        chunk_store=chunk_store,
+        output_filename=output_filename,
+        kernel=kernel,
+        metric=metric,
+        max_distance=max_distance,
+        tiles_per_process=tiles_per_process,
+        share_strings=share_strings,
+        write_in_place=write_in_place
+    )
+
+
+def extend_string_distance_matrix_by_chunks(
+    dist_matrix: np.ndarray,
+    strings: list[str],
+    new_strings: list[str],
+    num_chunks: int = None,
+    max_num_processes: int = None,
+    chunk_store: ChunkStore = dummy_chunk_store,
+    num_bytes_for_each_distance = 1,
+    output_filename: str = None,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    tiles_per_process: int = 4
+) -> np.ndarray:
+    layout = 'condensed' if dist_matrix.ndim == 1 else 'square'
+    expected_shape = (
+        (triu_size(len(strings)),) if layout == 'condensed'
+        else (len(strings), len(strings))
+    )
+    if dist_matrix.shape != expected_shape:
+        raise Exception(
+            f'Distance matrix of shape {dist_matrix.shape} does not match {len(strings)} strings'
+        )
+    dist_dtype = num_bytes_to_uint_dtype(num_bytes_for_each_distance)
+    num_new_strings = len(new_strings)
+
+    if num_new_strings < 2:
+        new_dist = np.zeros(
+            (triu_size(num_new_strings),) if layout == 'condensed'
+            else (num_new_strings, num_new_strings),
+            dtype=dist_dtype
+        )
+    else:
+        new_dist = build_string_distance_matrix_by_chunks(
+            new_strings,
+            num_chunks=num_chunks,
+            max_num_processes=max_num_processes,
+            chunk_store=chunk_store,
+            num_bytes_for_each_distance=num_bytes_for_each_distance,
+            layout=layout,
+            kernel=kernel,
+            metric=metric,
+            max_distance=max_distance,
+            tiles_per_process=tiles_per_process
+        )
+    cross_dist = build_string_cross_distance_matrix_by_chunks(
+        strings,
+        new_strings,
+        max_num_processes=max_num_processes,
+        chunk_store=chunk_store,
+        num_bytes_for_each_distance=num_bytes_for_each_distance,
+        kernel=kernel,
+        metric=metric,
+        max_distance=max_distance,
+        tiles_per_process=tiles_per_process
+    )
+
+    num_strings = len(strings) + num_new_strings
+    out = None
+    if output_filename is not None:
+        out = open_matrix_memmap(output_filename, num_strings, dtype=dist_dtype, layout=layout)
+    extended_dist = extend_matrix(dist_matrix, cross_dist, new_dist, out=out)
+    if output_filename is not None:
+        extended_dist.flush()
+    return extended_dist
+
+
+def extend_seqs_distance_matrix_by_chunks(
+    dist_matrix: np.ndarray,
     seqs: list[SeqRecord],
+    new_seqs: list[SeqRecord],
     num_chunks: int = None,
     max_num_processes: int = None,
-    chunk_store: ChunkStore = dummy_chunk_store
+    chunk_store: ChunkStore = dummy_chunk_store,
+    output_filename: str = None,
+    kernel: str = 'editdistance',
+    metric: str = 'edit',
+    max_distance: Optional[int] = None,
+    tiles_per_process: int = 4
 ) -> np.ndarray:
-    return build_string_distance_matrix_by_chunks(
+    return extend_string_distance_matrix_by_chunks(
+        dist_matrix,
         strings=[str(seq.seq) for seq in seqs],
+        new_strings=[str(seq.seq) for seq in new_seqs],
         num_chunks=num_chunks,
         max_num_processes=max_num_processes,
-        chunk_store=chunk_store
+        chunk_store=chunk_store,
+        output_filename=output_filename,
+        kernel=kernel,
+        metric=metric,
+        max_distance=max_distance,
+        tiles_per_process=tiles_per_process
     )
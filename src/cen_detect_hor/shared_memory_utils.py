@@ -0,0 +1,91 @@
+from dataclasses import dataclass
+from multiprocessing.shared_memory import SharedMemory
+import os
+import tempfile
+import numpy as np
+
+attached_shared_memories: dict[str, SharedMemory] = {}
+attached_memmaps: dict[str, np.memmap] = {}
+
+def attach_shared_memory(name: str) -> SharedMemory:
+    if name not in attached_shared_memories:
+        attached_shared_memories[name] = SharedMemory(name=name)
+    return attached_shared_memories[name]
+
+@dataclass
+class SharedStrings:
+    name: str
+    num_strings: int
+    data_size: int
+
+    def get_offsets(self) -> np.ndarray:
+        return np.ndarray(
+            (self.num_strings + 1,), dtype=np.int64,
+            buffer=attach_shared_memory(self.name).buf
+        )
+
+    def get_data(self) -> np.ndarray:
+        return np.ndarray(
+            (self.data_size,), dtype=np.uint8,
+            buffer=attach_shared_memory(self.name).buf,
+            offset=(self.num_strings + 1) * np.dtype(np.int64).itemsize
+        )
+
+    def get_strings(self, start: int, end: int) -> list[str]:
+        offsets = self.get_offsets()
+        data = self.get_data()
+        return [
+            data[offsets[index]:offsets[index + 1]].tobytes().decode()
+            for index in range(start, end)
+        ]
+
+def create_shared_strings(strings: list[str]) -> tuple[SharedStrings, SharedMemory]:
+    encoded_strings = [string.encode() for string in strings]
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(encoded) for encoded in encoded_strings], out=offsets[1:])
+    shared_memory = SharedMemory(
+        create=True,
+        size=max(1, offsets.nbytes + int(offsets[-1]))
+    )
+    shared_strings = SharedStrings(
+        name=shared_memory.name,
+        num_strings=len(strings),
+        data_size=int(offsets[-1])
+    )
+    attached_shared_memories[shared_memory.name] = shared_memory
+    shared_strings.get_offsets()[:] = offsets
+    shared_strings.get_data()[:] = np.frombuffer(b''.join(encoded_strings), dtype=np.uint8)
+    return shared_strings, shared_memory
+
+def release_shared_memory(shared_memory: SharedMemory):
+    attached_shared_memories.pop(shared_memory.name, None)
+    shared_memory.close()
+    shared_memory.unlink()
+
+@dataclass
+class SharedStringsSlice:
+    shared_strings: SharedStrings
+    start: int
+    end: int
+
+    def __len__(self):
+        return self.end - self.start
+
+    def to_list(self) -> list[str]:
+        return self.shared_strings.get_strings(self.start, self.end)
+
+    def get_lengths(self) -> np.ndarray:
+        return np.diff(self.shared_strings.get_offsets()[self.start:self.end + 1])
+
+def attach_memmap(filename: str) -> np.memmap:
+    if filename not in attached_memmaps:
+        attached_memmaps[filename] = np.load(filename, mmap_mode='r+')
+    return attached_memmaps[filename]
+
+def shared_temp_filename(suffix: str = '.npy') -> str:
+    file_descriptor, filename = tempfile.mkstemp(
+        suffix=suffix,
+        dir='/dev/shm' if os.path.isdir('/dev/shm') else None
+    )
+    os.close(file_descriptor)
+    return filename